@@ -0,0 +1,198 @@
+import csv
+import json
+from collections import OrderedDict
+
+import numpy as np
+
+from .codec import codec
+from .params import (FeedbackParams, FeedbackQuadParams, RenderParams, Sample,
+                     int_index, param_index, param_keys, to_snake_case)
+
+
+voices = ('A', 'B', 'C', 'D')
+render_columns = ('render_id', 'folder', 'filename', 'duration', 'wait')
+render_defaults = RenderParams()
+json_keys = [to_snake_case(k) for k in param_keys[:18]]
+# Rows per array while reading a CSV
+csv_chunk = 4096
+
+
+class QuadParamsBatch:
+    """N FeedbackQuadParams as one (N, 4, 24) float64 array, with topology and RenderParams columns.
+
+    The codecs work on the array and columns directly, one row at a time,
+    without building FeedbackParams objects.
+    """
+
+    def __init__(self, params, topology=None, render=None):
+        self.params = np.asarray(params, dtype=np.float64).reshape(-1, len(voices), FeedbackParams.size)
+        n = len(self.params)
+        self.topology = list(topology) if topology is not None else ['FeedbackQuad'] * n
+        render = dict() if render is None else render
+        self.render = OrderedDict()
+        for name in render_columns:
+            if name in render:
+                col = render[name]
+            elif name == 'render_id':
+                col = ['{:02d}'.format(i) for i in range(n)]
+            else:
+                col = [render_defaults[name]] * n
+            self.render[name] = (np.asarray(col, dtype=np.float64) if name in ('duration', 'wait') else list(col))
+
+    @classmethod
+    def from_samples(cls, samples):
+        samples = list(samples)
+        params = np.empty((len(samples), len(voices), FeedbackParams.size))
+        for i, s in enumerate(samples):
+            for v, p in enumerate(s.synth_params.params):
+                params[i, v] = p.to_vec()
+        render = OrderedDict((name, [s.render_params[name] for s in samples]) for name in render_columns)
+        return cls(params, [s.topology for s in samples], render)
+
+    def sample(self, i):
+        """Materialize row i as a Sample."""
+        render_params = RenderParams(**{name: self._render_value(name, i) for name in render_columns})
+        return Sample(self.topology[i], render_params, FeedbackQuadParams.from_array(self.params[i]))
+
+    def samples(self):
+        for i in range(len(self)):
+            yield self.sample(i)
+
+    def _render_value(self, name, i):
+        col = self.render[name]
+        return float(col[i]) if name in ('duration', 'wait') else col[i]
+
+    def _row_json(self, i):
+        voices_json = []
+        for row in self.params[i].tolist():
+            for j in int_index:
+                if row[j].is_integer():
+                    row[j] = int(row[j])
+            dct = OrderedDict(zip(json_keys, row))
+            dct['fback_scalars'] = row[18:21]
+            dct['out_scalars'] = row[21:24]
+            voices_json.append(dct)
+        return OrderedDict([
+            ('topology', self.topology[i]),
+            ('render_params', OrderedDict((name, self._render_value(name, i)) for name in render_columns)),
+            ('synth_params', voices_json),
+        ])
+
+    def to_json(self):
+        """List of Sample.to_json() style dicts."""
+        return [self._row_json(i) for i in range(len(self))]
+
+    @classmethod
+    def from_json(cls, dcts):
+        """From an iterable of Sample.to_json() style dicts."""
+        topology, params = [], []
+        render = OrderedDict((name, []) for name in render_columns)
+        for dct in dcts:
+            topology.append(dct['topology'])
+            for name in render_columns:
+                render[name].append(dct['render_params'].get(name, render_defaults[name]))
+            params.append([[voice[k] for k in json_keys] + list(voice['fback_scalars']) + list(voice['out_scalars'])
+                           for voice in dct['synth_params']])
+        return cls(np.array(params, dtype=np.float64).reshape(-1, len(voices), FeedbackParams.size), topology, render)
+
+    def write_jsonl(self, filename):
+        """One Sample per line, as read by rpp.corpus. Same bytes as codec.encode of each sample."""
+        flat = self.params.reshape(len(self), len(voices) * FeedbackParams.size)
+        with open(filename, 'wb', buffering=1 << 20) as f:
+            for i in range(len(self)):
+                render = OrderedDict((name, self._render_value(name, i)) for name in render_columns)
+                f.write(codec.encode_values(self.topology[i], render, flat[i].tolist()))
+                f.write(b'\n')
+
+    @classmethod
+    def read_jsonl(cls, filename):
+        with open(filename) as f:
+            return cls.from_json(json.loads(line) for line in f if line.strip())
+
+    def csv_header(self):
+        return list(render_columns) + ['topology'] + ['{}{}'.format(k, v) for v in voices for k in param_keys]
+
+    def to_csv(self, filename):
+        """Stream to CSV, one row per quad: render columns, topology, then the 96 suffixed params."""
+        with open(filename, 'w', newline='') as f:
+            wr = csv.writer(f)
+            wr.writerow(self.csv_header())
+            flat = self.params.reshape(len(self), len(voices) * FeedbackParams.size)
+            wr.writerows(([self._render_value(name, i) for name in render_columns] + [self.topology[i]] + flat[i].tolist()
+                          for i in range(len(self))))
+
+    @classmethod
+    def from_csv(cls, filename):
+        """Read back a CSV written by to_csv. Params are parsed csv_chunk rows at a time."""
+        with open(filename, newline='') as f:
+            rd = csv.reader(f)
+            header = next(rd)
+            n_meta = len(render_columns) + 1
+            if header[n_meta:] != ['{}{}'.format(k, v) for v in voices for k in param_keys]:
+                raise ValueError('Unexpected CSV columns in {}'.format(filename))
+            render = OrderedDict((name, []) for name in render_columns)
+            topology, chunks, chunk = [], [], []
+            for row in rd:
+                if not row:
+                    continue
+                for name, val in zip(render_columns, row):
+                    render[name].append(val)
+                topology.append(row[n_meta - 1])
+                chunk.append(row[n_meta:])
+                if len(chunk) == csv_chunk:
+                    chunks.append(np.array(chunk, dtype=np.float64))
+                    chunk = []
+        chunks.append(np.array(chunk, dtype=np.float64).reshape(-1, len(voices) * FeedbackParams.size))
+        return cls(np.concatenate(chunks), topology, render)
+
+    def to_columns(self, params=None, unmap=False, spec=None):
+        """Dataframe-ready dict of 1-d arrays, keyed like FeedbackQuadParams.to_dataframe (koscRA, ...).
+
+        The param columns are views into the batch unless unmap is set.
+        """
+        keys = [k for k in param_keys if params is None or k in params]
+        columns = OrderedDict((name, np.asarray(self.render[name])) for name in render_columns)
+        columns['topology'] = np.asarray(self.topology)
+        values = spec.unmap_batch(param_keys, self.params) if unmap is True else self.params
+        for v, suffix in enumerate(voices):
+            for k in keys:
+                columns['{}{}'.format(k, suffix)] = values[:, v, param_index[k]]
+        return columns
+
+    def __getitem__(self, index):
+        """Row i as a Sample, or a slice as a new batch sharing the params array."""
+        if isinstance(index, slice):
+            return QuadParamsBatch(self.params[index], self.topology[index],
+                                   OrderedDict((name, col[index]) for name, col in self.render.items()))
+        return self.sample(index)
+
+    def __len__(self):
+        return len(self.params)
+
+    def __repr__(self):
+        return '<QuadParamsBatch({} quads)>'.format(len(self))
+
+
+def test_batch():
+    import os
+    import tempfile
+    alpha = FeedbackQuadParams.default_params()
+    batch = QuadParamsBatch(alpha.randomize_batch(50, ['koscR', 'lfoCSwitch'], seed=1),
+                            render={'render_id': [str(i) for i in range(50)], 'duration': np.arange(50.0)})
+    tmp = tempfile.mkdtemp()
+    print(QuadParamsBatch.from_json(json.loads(json.dumps(batch.to_json()))).params.tolist() == batch.params.tolist())
+    print(Sample.from_json(batch.to_json()[3]).synth_params.to_vec().tolist() == batch.params[3].ravel().tolist())
+    batch.to_csv(os.path.join(tmp, 'batch.csv'))
+    back = QuadParamsBatch.from_csv(os.path.join(tmp, 'batch.csv'))
+    print(back.params.tolist() == batch.params.tolist() and back.render['render_id'] == batch.render['render_id'])
+    batch.write_jsonl(os.path.join(tmp, 'batch.jsonl'))
+    with open(os.path.join(tmp, 'batch.jsonl'), 'rb') as f:
+        print(f.read() == codec.encode_many(batch.samples()) and
+              [json.loads(line) for line in codec.encode_many(batch.samples()).splitlines()] == batch.to_json())
+    print(QuadParamsBatch.read_jsonl(os.path.join(tmp, 'batch.jsonl')).render['duration'].tolist() == list(range(50)))
+    columns = batch.to_columns()
+    print(list(columns)[-1] == 'outZD' and (columns['koscRC'] == batch.params[:, 2, 0]).all())
+    print(columns['koscRC'].base is not None and batch[10:20][0].render_params['render_id'] == '10')
+
+if __name__ == "__main__":
+    test_batch()
@@ -0,0 +1,216 @@
+"""Benchmarks for the params/spec hot paths.
+
+    python -m rpp.bench                               # 1, 1k, 1M
+    python -m rpp.bench --sizes 1 1000 --out bench_results.json --baseline bench_baseline.json
+    python -m rpp.bench --save-baseline bench_baseline.json
+
+Each benchmark runs once small as a warm-up, then reports the best of
+--repeat timings, each from timeit's autorange, so tiny sizes are looped
+until they take long enough to time. The slowest per-object benchmarks
+(to_json, from_json, randomize, to_dataframe and the JSON round trips) stop
+at 100k patches and the rest at 1M, unless --full is given.
+"""
+import argparse
+import gc
+import json
+import platform
+import sys
+import timeit
+import tracemalloc
+from collections import OrderedDict
+
+import numpy as np
+
+from .codec import codec
+from .params import FeedbackParams, FeedbackQuadParams, RenderParams, Sample, param_keys
+from .spec import rust_spec
+
+
+benches = OrderedDict()
+
+def bench(name, limit=None):
+    """Register setup(n) -> run(). run() does n ops. limit caps n unless --full."""
+    def register(setup):
+        benches[name] = (setup, limit)
+        return setup
+    return register
+
+spec = rust_spec()
+spec_keys = list(spec.keys())
+
+@bench('spec.map_spec', limit=10**6)
+def bench_map_spec(n):
+    keys = [spec_keys[i % len(spec_keys)] for i in range(n)]
+    vals = np.random.random(n).tolist()
+    def run():
+        for k,v in zip(keys, vals):
+            spec.map_spec(k, v)
+    return run
+
+@bench('spec.unmap_spec', limit=10**6)
+def bench_unmap_spec(n):
+    keys = [spec_keys[i % len(spec_keys)] for i in range(n)]
+    vals = [spec.map_spec(k, v) for k,v in zip(keys, np.random.random(n).tolist())]
+    def run():
+        for k,v in zip(keys, vals):
+            spec.unmap_spec(k, v)
+    return run
+
+@bench('spec.map_batch')
+def bench_map_batch(n):
+    vals = np.random.random((n, len(spec_keys)))
+    return lambda: spec.map_batch(spec_keys, vals)
+
+@bench('FeedbackParams.from_list', limit=10**6)
+def bench_from_list(n):
+    plist = FeedbackParams.default_params().values()
+    def run():
+        for i in range(n):
+            FeedbackParams.from_list(plist)
+    return run
+
+@bench('FeedbackParams.serialize', limit=10**6)
+def bench_serialize(n):
+    alpha = FeedbackParams.default_params()
+    def run():
+        for i in range(n):
+            alpha.serialize()
+    return run
+
+@bench('FeedbackParams.to_json', limit=10**5)
+def bench_to_json(n):
+    alpha = FeedbackParams.default_params()
+    def run():
+        for i in range(n):
+            alpha.to_json()
+    return run
+
+@bench('FeedbackParams.from_json', limit=10**5)
+def bench_from_json(n):
+    dct = FeedbackParams.default_params().to_json()
+    def run():
+        for i in range(n):
+            FeedbackParams.from_json(dct)
+    return run
+
+@bench('FeedbackQuadParams.randomize', limit=10**5)
+def bench_randomize(n):
+    alpha = FeedbackQuadParams.default_params()
+    def run():
+        for i in range(n):
+            alpha.randomize(param_keys, spec=spec)
+    return run
+
+@bench('FeedbackQuadParams.randomize_batch')
+def bench_randomize_batch(n):
+    alpha = FeedbackQuadParams.default_params()
+    return lambda: alpha.randomize_batch(n, spec_keys, spec=spec, seed=0)
+
+@bench('FeedbackQuadParams.to_dataframe', limit=10**5)
+def bench_to_dataframe(n):
+    alpha = FeedbackQuadParams.default_params()
+    def run():
+        for i in range(n):
+            alpha.to_dataframe()
+    return run
+
+@bench('FeedbackQuadParams.to_vec', limit=10**6)
+def bench_to_vec(n):
+    alpha = FeedbackQuadParams.default_params()
+    def run():
+        for i in range(n):
+            alpha.to_vec()
+    return run
+
+@bench('Sample.json_roundtrip', limit=10**5)
+def bench_sample_roundtrip(n):
+    sample = Sample('FeedbackQuad', RenderParams(), FeedbackQuadParams.default_params())
+    def run():
+        for i in range(n):
+            Sample.from_json(json.loads(json.dumps(sample.to_json())))
+    return run
+
+@bench('SampleCodec.roundtrip', limit=10**5)
+def bench_codec_roundtrip(n):
+    sample = Sample('FeedbackQuad', RenderParams(), FeedbackQuadParams.default_params())
+    def run():
+        for i in range(n):
+            codec.decode(codec.encode(sample))
+    return run
+
+
+def measure(setup, n, memory=True, repeat=3):
+    """Returns ops/sec, best of repeat, and peak traced memory in bytes for n ops."""
+    setup(min(n, 1000))()
+    gc.collect()
+    timer = timeit.Timer(setup(n))
+    elapsed = float('inf')
+    for i in range(repeat):
+        number, seconds = timer.autorange()
+        elapsed = min(elapsed, seconds / number)
+    peak = None
+    if memory:
+        run = setup(n)
+        gc.collect()
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return OrderedDict([('n', n), ('seconds', elapsed), ('ops_per_sec', n / elapsed if elapsed else float('inf')),
+                        ('peak_bytes', peak)])
+
+def run_all(sizes, names=None, full=False, memory=True, repeat=3, out=sys.stdout):
+    results = OrderedDict()
+    for name, (setup, limit) in benches.items():
+        if names and not any(s in name for s in names):
+            continue
+        for n in sizes:
+            if limit is not None and n > limit and not full:
+                continue
+            r = measure(setup, n, memory=memory, repeat=repeat)
+            results['{}[{}]'.format(name, n)] = r
+            print('{:<40} {:>14,.0f} ops/s  {:>12}'.format(
+                '{}[{}]'.format(name, n), r['ops_per_sec'],
+                '' if r['peak_bytes'] is None else '{:,} B'.format(r['peak_bytes'])), file=out)
+    return results
+
+def compare(results, baseline, threshold=0.1):
+    """Benchmarks whose ops/sec fell more than threshold below the baseline."""
+    regressions = OrderedDict()
+    for key, r in results.items():
+        if key in baseline:
+            ratio = r['ops_per_sec'] / baseline[key]['ops_per_sec']
+            if ratio < 1.0 - threshold:
+                regressions[key] = ratio
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m rpp.bench', description='Benchmark the params/spec hot paths.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 1000, 1000000])
+    parser.add_argument('--only', nargs='+', help='run benchmarks whose name contains any of these')
+    parser.add_argument('--full', action='store_true', help='run per-object benchmarks at every size')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--repeat', type=int, default=3, help='report the best of this many timings')
+    parser.add_argument('--out', help='write results here')
+    parser.add_argument('--baseline', help='compare against a saved results file')
+    parser.add_argument('--save-baseline', help='also write results here')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed slowdown before flagging')
+    args = parser.parse_args(argv)
+
+    results = run_all(args.sizes, args.only, args.full, not args.no_memory, args.repeat)
+    doc = OrderedDict([('python', platform.python_version()), ('numpy', np.__version__),
+                       ('machine', platform.machine()), ('results', results)])
+    for filename in filter(None, [args.out, args.save_baseline]):
+        with open(filename, 'w') as f:
+            json.dump(doc, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)['results'], args.threshold)
+        for key, ratio in regressions.items():
+            print('REGRESSION {:<40} {:.2f}x of baseline'.format(key, ratio))
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,266 @@
+"""Live FeedbackQuadParams shared between processes thru multiprocessing.shared_memory.
+
+One writer at a time (pass a multiprocessing.Lock to share writing), any
+number of readers, no serialization. Block layout, little-endian:
+
+    offset  size  field
+    0       2     magic b'rb'
+    2       1     version
+    3       1     value width in bytes, 8 (float64)
+    4       4     voices, uint32
+    8       4     params per voice, uint32 (FeedbackParams.size)
+    12      4     reserved, 0
+    16      8     seq, uint64
+    24      40    reserved, 0
+    64      ...   voices x params float64, voice-major, in param_keys order
+
+seq is a seqlock: the writer makes it odd before touching the values and
+even again after. A reader loads seq, copies the values, loads seq again and
+keeps the copy only if both loads are the same even number. A native reader
+needs an acquire fence after the first load and before the second, a native
+writer a release fence after each increment. A single aligned float64 never
+tears, so reading one value skips the seqlock.
+
+Python has no fences, so this module's reader and writer rely on the
+hardware keeping stores and loads in program order. That holds on x86
+(TSO) only. On ARM and other weakly ordered CPUs a read_into can return
+a torn copy with a matching seq; there, share the writer's lock with the
+readers or read from native code with the fences above.
+"""
+import multiprocessing
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from .params import FeedbackParams, FeedbackQuadParams, param_index, param_keys
+
+
+header = struct.Struct('<2sBBIII')
+header_size = 64
+seq_offset = 16
+magic = b'rb'
+version = 1
+
+
+def _open(name, create, size):
+    try:
+        return shared_memory.SharedMemory(name, create=create, size=size, track=create)
+    except TypeError:
+        # Python < 3.13 has no track and always registers the block with the
+        # resource tracker, which unlinks it when that tracker's process
+        # exits. Children from multiprocessing share their parent's tracker,
+        # so only a standalone process needs to take its registration back.
+        shm = shared_memory.SharedMemory(name, create=create, size=size)
+        if not create and multiprocessing.parent_process() is None:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class BusVoice:
+    """One voice on the bus. Reads and writes like a FeedbackParams."""
+    __slots__ = ('bus', 'base', 'vals')
+
+    def __init__(self, bus, index):
+        self.bus = bus
+        self.base = index * FeedbackParams.size
+        self.vals = bus._vals
+
+    def __getitem__(self, key):
+        return self.vals[self.base + param_index[key]]
+
+    def __setitem__(self, key, val):
+        if key not in param_index:
+            raise LookupError('Key \'{}\' not found in params dict'.format(key))
+        bus = self.bus
+        bus._begin()
+        try:
+            self.vals[self.base + param_index[key]] = val
+        finally:
+            bus._end()
+
+    def keys(self):
+        return param_keys
+
+    def values(self):
+        return self.bus.read()[self.base // FeedbackParams.size].tolist()
+
+    def __repr__(self):
+        return '<BusVoice({})>'.format(self.base // FeedbackParams.size)
+
+
+class ParamBus:
+    """N voices x FeedbackParams.size float64 in shared memory, guarded by a seqlock.
+
+    Mirrors FeedbackQuadParams: bus[1]['koscR'] reads or writes one value,
+    bus.setall('koscR', 3.0) writes every voice at once. read() and
+    snapshot() return consistent copies of the whole block.
+    """
+
+    def __init__(self, shm, lock=None, owner=False):
+        self.shm = shm
+        self.lock = lock
+        self.owner = owner
+        tag, ver, width, self.voices, size, reserved = header.unpack_from(shm.buf, 0)
+        if tag != magic or ver != version or width != 8 or size != FeedbackParams.size:
+            raise ValueError('{} is not a param bus block'.format(shm.name))
+        self._seq = shm.buf[seq_offset:seq_offset + 8].cast('Q')
+        self._vals = shm.buf[header_size:header_size + self.voices * size * 8].cast('d')
+        self.values = np.frombuffer(shm.buf, dtype='<f8', count=self.voices * size,
+                                    offset=header_size).reshape(self.voices, size)
+        self._voices = tuple(BusVoice(self, i) for i in range(self.voices))
+
+    @classmethod
+    def create(cls, name=None, voices=4, params=None, lock=None):
+        """Allocate a new block, filled from params (default the default params)."""
+        shm = _open(name, True, header_size + voices * FeedbackParams.size * 8)
+        shm.buf[:header_size] = bytes(header_size)
+        header.pack_into(shm.buf, 0, magic, version, 8, voices, FeedbackParams.size, 0)
+        bus = cls(shm, lock, owner=True)
+        bus.write(FeedbackQuadParams.default_params() if params is None else params)
+        return bus
+
+    @classmethod
+    def attach(cls, name, lock=None):
+        """Map an existing block by name."""
+        return cls(_open(name, False, 0), lock)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def seq(self):
+        """Even when no write is in progress. Changes on every write."""
+        return self._seq[0]
+
+    def _begin(self):
+        if self.lock is not None:
+            self.lock.acquire()
+        self._seq[0] += 1
+
+    def _end(self):
+        self._seq[0] += 1
+        if self.lock is not None:
+            self.lock.release()
+
+    def read_into(self, out, retries=100000):
+        """Copy a consistent snapshot into out, (voices, size) float64. Returns its seq.
+
+        Consistent on x86 only, see the module docstring.
+        """
+        seq, vals = self._seq, self.values
+        for i in range(retries):
+            before = seq[0]
+            if before & 1:
+                if i > 100:
+                    time.sleep(0)
+                continue
+            out[...] = vals
+            if seq[0] == before:
+                return before
+        raise RuntimeError('Param bus {} writer stalled mid-write'.format(self.name))
+
+    def read(self):
+        """Consistent copy of the block, (voices, size) float64."""
+        out = np.empty_like(self.values)
+        self.read_into(out)
+        return out
+
+    def snapshot(self):
+        """Consistent copy as a FeedbackQuadParams."""
+        return FeedbackQuadParams.from_array(self.read())
+
+    def write(self, params):
+        """Replace the whole block from a FeedbackQuadParams or a (voices, size) array."""
+        vals = params.to_vec() if isinstance(params, FeedbackQuadParams) else np.asarray(params, dtype=np.float64)
+        self._begin()
+        try:
+            self.values[...] = vals.reshape(self.voices, FeedbackParams.size)
+        finally:
+            self._end()
+
+    def update(self, changes):
+        """Apply (voice, index, value) changes, eg. from FeedbackQuadParams.flush_changes, in one write."""
+        size, vals = FeedbackParams.size, self._vals
+        self._begin()
+        try:
+            for voice, i, val in changes:
+                vals[voice * size + i] = val
+        finally:
+            self._end()
+
+    def setall(self, param, val):
+        """Set param for every voice in one write. Returns self."""
+        i = param_index[param]
+        self._begin()
+        try:
+            self.values[:, i] = val
+        finally:
+            self._end()
+        return self
+
+    def changed(self, seq):
+        """True if there has been a write since seq."""
+        return self._seq[0] != seq
+
+    def __getitem__(self, index):
+        return self._voices[index]
+
+    def __len__(self):
+        return self.voices
+
+    def close(self):
+        """Unmap. Views taken from values must be gone by now. The creator also unlinks the block."""
+        self._voices = ()
+        self._seq.release()
+        self._vals.release()
+        self.values = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __repr__(self):
+        return '<ParamBus({!r}, {} voices)>'.format(self.name, self.voices)
+
+
+def _hammer(name, n):
+    bus = ParamBus.attach(name)
+    for i in range(n):
+        bus.write(np.full((bus.voices, FeedbackParams.size), float(i)))
+    bus.close()
+
+def test_bus():
+    with ParamBus.create() as bus:
+        alpha = FeedbackQuadParams.default_params()
+        print(bus.snapshot().to_vec().tolist() == alpha.to_vec().tolist())
+        other = ParamBus.attach(bus.name)
+        bus[1]['koscR'] = 3.0
+        bus.setall('outZ', 0.5)
+        print(other[1]['koscR'] == 3.0 and other.read()[:, param_index['outZ']].tolist() == [0.5] * 4)
+        seq = other.seq
+        alpha[2]['lfoPot'] = 0.7
+        other.update(alpha.flush_changes())
+        print(bus.changed(seq) and bus[2]['lfoPot'] == 0.7 and bus.seq % 2 == 0)
+        other.close()
+        bus.write(np.zeros((4, FeedbackParams.size)))
+        writer = multiprocessing.get_context('spawn').Process(target=_hammer, args=(bus.name, 20000))
+        writer.start()
+        out = np.empty_like(bus.values)
+        torn = reads = 0
+        while writer.is_alive():
+            bus.read_into(out)
+            torn += int((out != out[0, 0]).any())
+            reads += 1
+        writer.join()
+        print(torn == 0 and reads > 0 and bus.read()[0, 0] == 19999.0)
+
+if __name__ == "__main__":
+    test_bus()
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+import shutil
+from collections import OrderedDict, Counter
+
+import numpy as np
+
+from .params import param_keys
+from .spec import rust_spec
+
+
+def param_array(sample):
+    """(voices, 24) float64 synth params of a Sample."""
+    return np.stack([p.to_vec() for p in sample.synth_params.params])
+
+def out_of_range(vec, spec=None):
+    """Mask of the values in a (voices, 24) array outside their spec range, or not finite."""
+    spec = rust_spec() if spec is None else spec
+    bounds = np.array([(min(spec[k].lo, spec[k].hi), max(spec[k].lo, spec[k].hi)) for k in param_keys])
+    with np.errstate(invalid='ignore'):
+        return ~((vec >= bounds[:, 0]) & (vec <= bounds[:, 1]))
+
+def quantize(sample, spec=None, steps=1024):
+    """Canonical integer form of a Sample's synth params.
+
+    Params are unmapped thru the spec and rounded to steps levels, so the grid
+    follows each param's range and curve. Binary params get two levels.
+    Values outside the spec clip to the end of the grid, see cache_key.
+    NaN goes to level -1.
+    """
+    spec = rust_spec() if spec is None else spec
+    vec = param_array(sample)
+    norm = spec.unmap_batch(param_keys, vec)
+    levels = np.array([1 if spec[k].curve == 'binary' else steps for k in param_keys], dtype=np.float64)
+    nan = np.isnan(norm)
+    out = np.rint(np.where(nan, 0.0, norm) * levels).astype(np.int32)
+    out[nan] = -1
+    return out
+
+def _field(h, data):
+    """Hash data length-prefixed, so neighbouring fields can't run together."""
+    h.update(len(data).to_bytes(4, 'little'))
+    h.update(data)
+
+def cache_key(sample, spec=None, steps=1024):
+    """Hash of topology, duration and the quantized synth params.
+
+    quantize clips, so params outside the spec go into the hash raw as well.
+    Two renders past the same end of a range only share a key when the exact
+    values match.
+    """
+    h = hashlib.sha1()
+    _field(h, sample.topology.encode('utf-8'))
+    _field(h, '{:.3f}'.format(float(sample.render_params['duration'])).encode('utf-8'))
+    h.update(quantize(sample, spec, steps).tobytes())
+    vec = param_array(sample)
+    outside = out_of_range(vec, spec)
+    if outside.any():
+        h.update(b'raw')
+        h.update(np.packbits(outside).tobytes())
+        h.update(vec[outside].tobytes())
+    return h.hexdigest()
+
+
+class RenderCache:
+    """Content-addressed cache of rendered files with LRU eviction under a disk budget.
+
+    index.json, which holds the LRU order, is written every save_every changes
+    (puts, drops and hits) and on close(). Use it as a context manager, or call
+    close() or save(), so the last changes are not lost.
+    """
+
+    def __init__(self, root, max_bytes=10 * 2**30, spec=None, steps=1024, save_every=64):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.spec = rust_spec() if spec is None else spec
+        self.steps = steps
+        self.save_every = save_every
+        self.changes = 0
+        self.stats = Counter()
+        os.makedirs(root, exist_ok=True)
+        self.index = OrderedDict()
+        index_file = os.path.join(root, 'index.json')
+        if os.path.exists(index_file):
+            with open(index_file) as f:
+                self.index = OrderedDict((k, tuple(v)) for k,v in json.load(f))
+        self.nbytes = sum(size for name, size in self.index.values())
+
+    def key(self, sample):
+        return cache_key(sample, self.spec, self.steps)
+
+    def get(self, sample):
+        """Path of the cached render, or None."""
+        key = self.key(sample)
+        entry = self.index.get(key)
+        if entry is not None and os.path.exists(os.path.join(self.root, entry[0])):
+            self.index.move_to_end(key)
+            self.stats['hits'] += 1
+            self._changed()
+            return os.path.join(self.root, entry[0])
+        if entry is not None:
+            self._drop(key)
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, sample, filename, move=False):
+        """Add a rendered file. Returns its path in the cache."""
+        key = self.key(sample)
+        if key in self.index:
+            self._drop(key)
+        name = key + os.path.splitext(filename)[1]
+        path = os.path.join(self.root, name)
+        (shutil.move if move else shutil.copyfile)(filename, path)
+        size = os.path.getsize(path)
+        self.index[key] = (name, size)
+        self.nbytes += size
+        self.evict()
+        self._changed()
+        return path
+
+    def evict(self):
+        """Drop least recently used renders until under max_bytes."""
+        while self.nbytes > self.max_bytes and len(self.index) > 1:
+            self._drop(next(iter(self.index)))
+            self.stats['evictions'] += 1
+
+    def _drop(self, key):
+        name, size = self.index.pop(key)
+        self.nbytes -= size
+        self.changes += 1
+        try:
+            os.remove(os.path.join(self.root, name))
+        except FileNotFoundError:
+            pass
+
+    def _changed(self):
+        self.changes += 1
+        if self.changes >= self.save_every:
+            self.save()
+
+    def save(self):
+        """Write the index, in LRU order."""
+        tmp = os.path.join(self.root, 'index.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(list(self.index.items()), f)
+        os.replace(tmp, os.path.join(self.root, 'index.json'))
+        self.changes = 0
+
+    def close(self):
+        """Write the index if anything changed since the last save."""
+        if self.changes:
+            self.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def hit_rate(self):
+        total = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / total if total else 0.0
+
+    def __contains__(self, sample):
+        return self.key(sample) in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __repr__(self):
+        return '<RenderCache({0.root!r}, {1} renders, {0.nbytes} bytes, hit rate {2:.2f})>'.format(
+            self, len(self), self.hit_rate())
+
+
+def test_cache():
+    import tempfile
+    from .params import Sample, RenderParams, FeedbackQuadParams
+    tmp = tempfile.mkdtemp()
+    cache = RenderCache(os.path.join(tmp, 'cache'), max_bytes=250)
+    alpha = FeedbackQuadParams.default_params()
+    beta = alpha.deepcopy().setall('lfoCSwitch', 0.4)
+    gamma = alpha.deepcopy().setall('koscR', 10.0)
+    print(cache.key(Sample('FeedbackQuad', RenderParams(), alpha)) == cache.key(Sample('FeedbackQuad', RenderParams(), beta)))
+    wav = os.path.join(tmp, 'sample.wav')
+    with open(wav, 'wb') as f:
+        f.write(b'\0' * 100)
+    print(cache.get(Sample('FeedbackQuad', RenderParams(), alpha)) is None)
+    cache.put(Sample('FeedbackQuad', RenderParams(), alpha), wav)
+    print(cache.get(Sample('FeedbackQuad', RenderParams(render_id='01'), beta)) is not None)
+    cache.put(Sample('FeedbackQuad', RenderParams(), gamma), wav)
+    cache.put(Sample('FeedbackQuad', RenderParams(duration=5.0), alpha), wav)
+    print(len(cache) == 2 and cache.stats['evictions'] == 1)
+    print(len(RenderCache(cache.root)) == 0)
+    cache.close()
+    print(len(RenderCache(cache.root)) == 2)
+    with RenderCache(os.path.join(tmp, 'lru'), max_bytes=250) as lru:
+        first, second = [Sample('FeedbackQuad', RenderParams(duration=d), alpha) for d in (1.0, 2.0)]
+        lru.put(first, wav)
+        lru.put(second, wav)
+        lru.get(first)
+    print(list(RenderCache(lru.root).index) == [lru.key(second), lru.key(first)])
+    with np.errstate(all='raise'):
+        print((quantize(Sample('FeedbackQuad', RenderParams(), alpha.deepcopy().setall('koscR', float('nan'))))[:, 0] == -1).all())
+    lo, hi = rust_spec()['koscR'].lo, rust_spec()['koscR'].hi
+    keys = [cache.key(Sample('FeedbackQuad', RenderParams(), alpha.deepcopy().setall('koscR', v)))
+            for v in (hi, hi + 1.0, hi + 2.0, lo - 1.0, float('nan'), hi + 1.0)]
+    print(len(set(keys)) == 5 and keys[1] == keys[5])
+
+if __name__ == "__main__":
+    test_cache()
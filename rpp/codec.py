@@ -0,0 +1,233 @@
+"""Sample JSON codec compiled once from the param schema.
+
+The output is byte for byte the compact JSON the Rust side has always read,
+whole binary-curve params (lfoCSwitch) included as ints, and equals
+json.dumps(sample.to_json(), separators=(',', ':')). Encoding fills one precomputed
+%-template with the 96 param values; decoding pulls the values out of the
+parsed voices by a precomputed key table straight into FeedbackParams buffers.
+"""
+import json
+import math
+from array import array
+from json.encoder import encode_basestring_ascii
+
+import numpy as np
+
+from .params import (FeedbackParams, FeedbackQuadParams, RenderParams, Sample,
+                     int_index, param_index, param_keys, to_camel_case, to_snake_case)
+from .spec import rust_spec
+
+
+json_keys = tuple(to_snake_case(k) for k in param_keys[:18])
+render_keys = tuple(RenderParams().keys())
+voice_template = '{' + ','.join('"{}":%r'.format(k) for k in json_keys) + \
+    ',"fback_scalars":[%r,%r,%r],"out_scalars":[%r,%r,%r]}'
+number_types = frozenset([float, int])
+scalar_slots = {'fback_scalars': slice(18, 21), 'out_scalars': slice(21, 24)}
+
+
+def _scalar(val):
+    """JSON for one render param value, as json.dumps would write it."""
+    kind = type(val)
+    if kind is str:
+        return encode_basestring_ascii(val)
+    if kind is float and math.isfinite(val):
+        return float.__repr__(val)
+    if kind is int:
+        return int.__repr__(val)
+    return json.dumps(val)
+
+
+class SampleCodec:
+    """Encode and decode Samples and FeedbackQuadParams to and from JSON bytes.
+
+    Types are always checked: every param must be a number and unknown fields
+    are rejected. Voices with missing fields are filled from the default
+    params. Ranges are checked against spec
+    only when validate is set, since the default params sit outside rust_spec
+    in places (eg. vactrolDecay).
+    """
+
+    def __init__(self, spec=None, validate=False, voices=4):
+        self.spec = rust_spec() if spec is None else spec
+        self.validate = validate
+        self.voices = voices
+        self.synth_template = '[' + ','.join([voice_template] * voices) + ']'
+        self.int_slots = [v * FeedbackParams.size + i for v in range(voices) for i in int_index]
+        self.lo = np.array([min(self.spec[k].lo, self.spec[k].hi) if k in self.spec.keys() else -np.inf
+                            for k in param_keys])
+        self.hi = np.array([max(self.spec[k].lo, self.spec[k].hi) if k in self.spec.keys() else np.inf
+                            for k in param_keys])
+
+    def check_range(self, vals):
+        """Raise ValueError if any of the flat params are outside the spec."""
+        vec = np.asarray(vals, dtype=np.float64).reshape(-1, FeedbackParams.size)
+        bad = np.argwhere((vec < self.lo) | (vec > self.hi) | np.isnan(vec))
+        if len(bad):
+            voice, i = bad[0]
+            raise ValueError('{} = {!r} in voice {} is outside the spec range [{}, {}]'.format(
+                param_keys[i], vec[voice, i], voice, self.lo[i], self.hi[i]))
+
+    def _synth_str(self, quad):
+        vals = []
+        for p in quad.params:
+            vals += p._buf.tolist()
+        return self._values_str(vals)
+
+    def _values_str(self, vals):
+        """synth_params JSON from the flat list of voices x 24 floats. Changes vals."""
+        if len(vals) != self.voices * FeedbackParams.size:
+            raise ValueError('Expected {} voices, got {}'.format(self.voices, len(vals) / FeedbackParams.size))
+        if self.validate:
+            self.check_range(vals)
+        if not math.isfinite(sum(vals)):
+            # nan or inf, which json writes as NaN and Infinity
+            size = FeedbackParams.size
+            return json.dumps([FeedbackParams.from_list(vals[i:i + size]).to_json() for i in range(0, len(vals), size)],
+                              separators=(',', ':'))
+        for i in self.int_slots:
+            if vals[i].is_integer():
+                vals[i] = int(vals[i])
+        return self.synth_template % tuple(vals)
+
+    def encode_quad(self, quad):
+        """FeedbackQuadParams to JSON bytes, as in Sample.to_json()['synth_params']."""
+        return self._synth_str(quad).encode('ascii')
+
+    def encode(self, sample):
+        """Sample to one line of JSON bytes, without the newline."""
+        return self._encode(sample.topology, sample.render_params, self._synth_str(sample.synth_params))
+
+    def encode_values(self, topology, render_params, vals):
+        """One line of JSON bytes from a topology, a render params mapping and the flat voices x 24 param list.
+
+        For rows of an array, eg. QuadParamsBatch, without building a Sample.
+        vals may be any sequence of numbers, numpy scalars and arrays included.
+        """
+        vals = np.asarray(vals, dtype=np.float64).ravel().tolist()
+        return self._encode(topology, render_params, self._values_str(vals))
+
+    def _encode(self, topology, rp, synth):
+        if tuple(rp.keys()) == render_keys:
+            render = '{{"render_id":{},"folder":{},"filename":{},"duration":{},"wait":{}}}'.format(
+                _scalar(rp['render_id']), _scalar(rp['folder']), _scalar(rp['filename']),
+                _scalar(rp['duration']), _scalar(rp['wait']))
+        else:
+            render = json.dumps(rp, separators=(',', ':'))
+        return '{{"topology":{},"render_params":{},"synth_params":{}}}'.format(
+            _scalar(topology), render, synth).encode('ascii')
+
+    def encode_many(self, samples):
+        """Newline terminated lines for many Samples, as one bytes."""
+        return b''.join([self.encode(s) + b'\n' for s in samples])
+
+    def _partial_voice(self, dct):
+        """A voice missing some fields. Checked, then filled from the default params."""
+        vals = FeedbackParams.default_params().values()
+        for k,v in dct.items():
+            if k in scalar_slots:
+                if type(v) is not list or len(v) != 3:
+                    raise ValueError('{} must be a list of 3 numbers'.format(k))
+                vals[scalar_slots[k]] = v
+            elif to_camel_case(k) in param_index:
+                vals[param_index[to_camel_case(k)]] = v
+            else:
+                raise ValueError('Unknown param \'{}\''.format(k))
+        self._check_types(vals)
+        return FeedbackParams._from_buffer(array('d', vals))
+
+    def _check_types(self, vals):
+        if not set(map(type, vals)) <= number_types:
+            raise ValueError('Param values must be numbers, got {!r}'.format(
+                [v for v in vals if type(v) not in number_types][0]))
+
+    def _voice(self, dct):
+        if type(dct) is not dict:
+            raise ValueError('Each voice must be a JSON object')
+        if len(dct) != 20:
+            return self._partial_voice(dct)
+        try:
+            fback, out = dct['fback_scalars'], dct['out_scalars']
+            vals = [dct[k] for k in json_keys]
+        except KeyError:
+            return self._partial_voice(dct)
+        if type(fback) is not list or type(out) is not list or len(fback) != 3 or len(out) != 3:
+            raise ValueError('fback_scalars and out_scalars must be lists of 3 numbers')
+        vals += fback
+        vals += out
+        self._check_types(vals)
+        return FeedbackParams._from_buffer(array('d', vals))
+
+    def decode_quad(self, data):
+        """FeedbackQuadParams from JSON bytes or the parsed list."""
+        voices = json.loads(data) if isinstance(data, (bytes, bytearray, memoryview, str)) else data
+        if type(voices) is not list:
+            raise ValueError('synth_params must be a list of voices')
+        quad = FeedbackQuadParams([self._voice(v) for v in voices])
+        if self.validate:
+            self.check_range(quad.to_vec())
+        return quad
+
+    def decode(self, data):
+        """Sample from one line of JSON bytes."""
+        dct = json.loads(data)
+        topology = dct['topology']
+        if type(topology) is not str:
+            raise ValueError('topology must be a string')
+        return Sample(topology, RenderParams(**dct['render_params']), self.decode_quad(dct['synth_params']))
+
+    def decode_lines(self, lines):
+        """Yield a Sample per non-blank line."""
+        for line in lines:
+            if line.strip():
+                yield self.decode(line)
+
+
+codec = SampleCodec()
+
+
+# Default voice as the Rust side has always received it.
+baseline_voice = ('{"kosc_r":18.6,"kosc_freq":0.85,"kosc_error":4.0,"lowpass_pot":0.85,"preamp_pot":0.19999999999999996,'
+                  '"powamp_pot":0.9,"lfo_pot":0.33,"lfo_cswitch":0,"lfo_width":0.5,"lfo_iphase":0.0,"lfo_lowpass_pot":0.5,'
+                  '"vactrol_attack":0.027,"vactrol_decay":4.0,"vactrol_hysteresis":6.0,"vactrol_depth":2.0,'
+                  '"vactrol_scalar":1.0,"lfo_gate":1.0,"vactrol_gate":1.0,"fback_scalars":[1.0,1.0,1.0],'
+                  '"out_scalars":[1.0,1.0,1.0]}')
+
+def test_codec():
+    alpha = FeedbackQuadParams.default_params()
+    print(codec.encode_quad(alpha) == ('[' + ','.join([baseline_voice] * 4) + ']').encode())
+    print(b'"lfo_cswitch":1,' in codec.encode_quad(alpha.deepcopy().setall('lfoCSwitch', 1)))
+    samples = [Sample('FeedbackQuad', RenderParams(render_id=str(i), folder='~/ü', duration=i),
+                      alpha.randomize(['koscR', 'lfoCSwitch', 'outZ'])) for i in range(200)]
+    lines = [codec.encode(s) for s in samples]
+    print(all(line == json.dumps(s.to_json(), separators=(',', ':')).encode() for line, s in zip(lines, samples)))
+    back = list(codec.decode_lines(lines))
+    print(all(b.synth_params.to_vec().tolist() == s.synth_params.to_vec().tolist() and
+              b.render_params == s.render_params for b, s in zip(back, samples)))
+    alpha[0]['koscR'] = float('nan')
+    print(codec.encode_quad(alpha) == json.dumps(alpha.to_json(), separators=(',', ':')).encode())
+    for voice in [{'kosc_r': 'loud'}, {'kosc_r': 1.0, 'kosc_fast': 2.0}, {'fback_scalars': [1.0, None, 1.0]}]:
+        bad = json.loads(lines[0])
+        bad['synth_params'][1].update(voice)
+        partial = json.loads(lines[0])
+        partial['synth_params'][1] = voice
+        for dct in (bad, partial):
+            try:
+                codec.decode(json.dumps(dct))
+                print(False)
+            except ValueError:
+                pass
+    partial['synth_params'][1] = {'kosc_r': 3}
+    print(codec.decode(json.dumps(partial)).synth_params[1]['koscR'] == 3.0)
+    row = samples[0].synth_params.to_vec()
+    line = codec.encode_values('FeedbackQuad', samples[0].render_params, row)
+    print(line == lines[0] and json.loads(line) == json.loads(lines[0]))
+    strict = SampleCodec(validate=True)
+    try:
+        strict.encode(samples[0])
+        print(False)
+    except ValueError as e:
+        print('vactrolDecay' in str(e))
+
+if __name__ == "__main__":
+    test_codec()
@@ -0,0 +1,94 @@
+import os
+
+from .codec import codec as default_codec
+
+
+class CorpusWriter:
+    """Buffered JSON-Lines writer. One Sample per line."""
+
+    def __init__(self, filename, mode='w', buffering=1 << 20, codec=default_codec):
+        self.codec = codec
+        self.file = open(filename, mode + 'b', buffering=buffering)
+        self.offset = self.file.tell()
+
+    def write(self, sample):
+        """Write one Sample. Returns its byte offset in the file."""
+        offset = self.offset
+        line = self.codec.encode(sample) + b'\n'
+        self.file.write(line)
+        self.offset += len(line)
+        return offset
+
+    def write_all(self, samples):
+        """Write many Samples. Returns the number written."""
+        n = 0
+        for sample in samples:
+            self.write(sample)
+            n += 1
+        return n
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_lines(filename, start=0, end=None):
+    """Yield (offset, line) for each line starting in [start, end). Skips blank lines."""
+    with open(filename, 'rb') as f:
+        pos = start
+        if start > 0:
+            # Land on the first line boundary at or after start. A line
+            # straddling start belongs to the previous shard.
+            f.seek(start - 1)
+            pos = start - 1 + len(f.readline())
+        while end is None or pos < end:
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                yield pos, line
+            pos += len(line)
+
+def read_corpus(filename, start=0, end=None, codec=default_codec):
+    """Lazily yield Samples from a JSON-Lines corpus. See shard_offsets for start/end."""
+    for offset, line in iter_lines(filename, start, end):
+        yield codec.decode(line)
+
+def shard_offsets(filename, n):
+    """Split a corpus into n byte ranges for read_corpus. Every record lands in exactly one shard."""
+    size = os.path.getsize(filename)
+    bounds = [size * i // n for i in range(n + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def build_index(filename):
+    """Byte offset of every record. Lets callers seek straight to record i."""
+    return [offset for offset, line in iter_lines(filename)]
+
+def read_at(filename, offset, codec=default_codec):
+    """Read the Sample starting at byte offset."""
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        return codec.decode(f.readline())
+
+
+def test_corpus():
+    import tempfile
+    from .params import RenderParams, FeedbackQuadParams, Sample
+    filename = os.path.join(tempfile.mkdtemp(), 'corpus.jsonl')
+    alpha = FeedbackQuadParams.default_params()
+    with CorpusWriter(filename) as w:
+        offsets = [w.write(Sample('FeedbackQuad', RenderParams(render_id=str(i)), alpha)) for i in range(100)]
+    ids = [s.render_params['render_id'] for s in read_corpus(filename)]
+    print(ids == [str(i) for i in range(100)])
+    sharded = [s.render_params['render_id'] for a,b in shard_offsets(filename, 7) for s in read_corpus(filename, a, b)]
+    print(sharded == ids)
+    print(build_index(filename) == offsets)
+    print(read_at(filename, offsets[42]).render_params['render_id'] == '42')
+
+if __name__ == "__main__":
+    test_corpus()
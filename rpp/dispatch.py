@@ -0,0 +1,282 @@
+import asyncio
+import json
+import logging
+
+from .display import TO_RS, FRM_RS, NW_THRD, NOTIFY, WAITING
+from .params import Sample
+
+
+# Line protocol. Every line starts with one of the rpp.display prefixes.
+#
+#   client -> renderer   TO_RS  + Sample.to_json()
+#   renderer -> client   FRM_RS + {"render_id": ..., "status": "ok" | "error", ...}
+#
+# NW_THRD, NOTIFY and WAITING lines from the renderer are informational and
+# are handed to on_message untouched.
+default_host = '127.0.0.1'
+default_port = 7878
+
+log = logging.getLogger(__name__)
+
+
+class RenderError(Exception):
+    """The renderer replied with status other than ok."""
+
+    def __init__(self, reply):
+        Exception.__init__(self, 'Render {} failed: {}'.format(reply.get('render_id'), reply.get('error', reply.get('status'))))
+        self.reply = reply
+
+
+def encode_request(sample):
+    return (TO_RS + json.dumps(sample.to_json(), separators=(',', ':')) + '\n').encode('utf-8')
+
+def encode_reply(reply):
+    return (FRM_RS + json.dumps(reply, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+class RenderClient:
+    """Pipelined asyncio client. Many renders in flight on one connection, at most max_in_flight."""
+
+    def __init__(self, host=default_host, port=default_port, max_in_flight=8, on_message=None):
+        self.host = host
+        self.port = port
+        self.max_in_flight = max_in_flight
+        self.on_message = on_message
+        self.pending = dict()
+        self.bad_lines = 0
+        self.reader = None
+        self.writer = None
+        self._slots = None
+        self._read_task = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._read_task = asyncio.ensure_future(self._read_loop())
+        return self
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+        if self._read_task is not None:
+            await self._read_task
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                try:
+                    line = line.decode('utf-8').rstrip('\n')
+                    if line.startswith(FRM_RS):
+                        reply = json.loads(line[len(FRM_RS):])
+                        future = self.pending.pop(reply['render_id'], None)
+                        if future is not None and not future.done():
+                            future.set_result(reply)
+                    elif self.on_message is not None:
+                        self.on_message(line)
+                except (UnicodeDecodeError, ValueError, KeyError, TypeError) as e:
+                    # One bad line must not take down every render in flight
+                    self.bad_lines += 1
+                    log.warning('Skipping bad line from renderer %r: %r', line[:200], e)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('Renderer connection closed'))
+            self.pending.clear()
+
+    async def render(self, sample):
+        """Send one Sample and wait for its reply. Raises RenderError on failure."""
+        render_id = sample.render_params['render_id']
+        async with self._slots:
+            if self._read_task is None or self._read_task.done():
+                raise ConnectionError('Renderer connection closed')
+            if render_id in self.pending:
+                raise ValueError('Render {} already in flight'.format(render_id))
+            future = asyncio.get_running_loop().create_future()
+            self.pending[render_id] = future
+            try:
+                self.writer.write(encode_request(sample))
+                await self.writer.drain()
+                reply = await future
+            finally:
+                self.pending.pop(render_id, None)
+        if reply.get('status') != 'ok':
+            raise RenderError(reply)
+        return reply
+
+    async def render_many(self, samples, return_exceptions=False):
+        """Render samples concurrently, up to max_in_flight at a time. Replies come back in order."""
+        return await asyncio.gather(*[self.render(s) for s in samples], return_exceptions=return_exceptions)
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class RenderServer:
+    """Stand-in renderer speaking the line protocol. Calls render_func(sample) for each request.
+
+    render_func is a coroutine function returning a dict merged into the reply.
+    Requests on a connection run concurrently, up to max_workers at once.
+    """
+
+    def __init__(self, render_func, host=default_host, port=default_port, max_workers=8):
+        self.render_func = render_func
+        self.host = host
+        self.port = port
+        self.max_workers = max_workers
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        workers = asyncio.Semaphore(self.max_workers)
+        tasks = set()
+        writer.write((NW_THRD + 'connected\n').encode('utf-8'))
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            line = line.decode('utf-8').rstrip('\n')
+            if not line.startswith(TO_RS):
+                writer.write((NOTIFY + 'unknown message\n').encode('utf-8'))
+                continue
+            task = asyncio.ensure_future(self._render(line[len(TO_RS):], workers, writer))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        writer.close()
+
+    async def _render(self, request, workers, writer):
+        """Parse and render one request. Always writes a reply, an error one if anything fails."""
+        render_id = None
+        async with workers:
+            try:
+                dct = json.loads(request)
+                try:
+                    render_id = dct['render_params']['render_id']
+                except (KeyError, TypeError):
+                    pass
+                writer.write((WAITING + str(render_id) + '\n').encode('utf-8'))
+                reply = {'render_id': render_id, 'status': 'ok'}
+                reply.update(await self.render_func(Sample.from_json(dct)) or {})
+                data = encode_reply(reply)
+            except Exception as e:
+                data = encode_reply({'render_id': render_id, 'status': 'error', 'error': str(e)})
+            writer.write(data)
+            await writer.drain()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+def test_dispatch():
+    import random
+    from .params import RenderParams, FeedbackQuadParams
+
+    async def fake_render(sample):
+        await asyncio.sleep(random.random() * 0.01)
+        if sample.render_params['render_id'] == '13':
+            raise RuntimeError('unlucky')
+        return {'filename': sample.render_params['filename']}
+
+    async def main():
+        alpha = FeedbackQuadParams.default_params()
+        samples = [Sample('FeedbackQuad', RenderParams(render_id=str(i), filename='{}.wav'.format(i)), alpha)
+                   for i in range(50)]
+        async with RenderServer(fake_render, port=0) as server:
+            async with RenderClient(port=server.port, max_in_flight=16) as client:
+                replies = await client.render_many(samples, return_exceptions=True)
+        print(all(r['filename'] == '{}.wav'.format(i) for i,r in enumerate(replies) if i != 13))
+        print(isinstance(replies[13], RenderError))
+
+    asyncio.run(main())
+
+def test_bad_lines():
+    from .params import RenderParams, FeedbackQuadParams
+
+    async def noisy(reader, writer):
+        # garbage ahead of the real reply must not fail the render
+        line = await reader.readline()
+        render_id = json.loads(line.decode('utf-8')[len(TO_RS):])['render_params']['render_id']
+        writer.write(b'\xff\xfe\n' + (FRM_RS + '{not json\n').encode('utf-8') + (FRM_RS + '{"status":"ok"}\n').encode('utf-8'))
+        writer.write(encode_reply({'render_id': render_id, 'status': 'ok'}))
+        await writer.drain()
+        await reader.read()
+        writer.close()
+
+    async def main():
+        server = await asyncio.start_server(noisy, default_host, 0)
+        alpha = FeedbackQuadParams.default_params()
+        async with server:
+            async with RenderClient(port=server.sockets[0].getsockname()[1]) as client:
+                reply = await client.render(Sample('FeedbackQuad', RenderParams(render_id='x'), alpha))
+        print(reply['status'] == 'ok' and client.bad_lines == 3)
+
+    logging.disable(logging.WARNING)
+    try:
+        asyncio.run(main())
+    finally:
+        logging.disable(logging.NOTSET)
+
+def test_bad_requests():
+    from .params import RenderParams, FeedbackQuadParams
+
+    async def echo(sample):
+        return {}
+
+    async def hang_up(reader, writer):
+        writer.close()
+
+    async def main():
+        alpha = FeedbackQuadParams.default_params()
+        async with RenderServer(echo, port=0) as server:
+            async with RenderClient(port=server.port) as client:
+                reply = await asyncio.wait_for(client.render(Sample('FeedbackQuad', RenderParams(render_id=7), alpha)), 5)
+            print(reply['render_id'] == 7 and reply['status'] == 'ok')
+            reader, writer = await asyncio.open_connection(default_host, server.port)
+            writer.write((TO_RS + '{not json\n' + TO_RS + '{"render_params":{"render_id":"y"}}\n').encode('utf-8'))
+            await writer.drain()
+            replies = []
+            while len(replies) < 2:
+                line = (await asyncio.wait_for(reader.readline(), 5)).decode('utf-8')
+                if line.startswith(FRM_RS):
+                    replies.append(json.loads(line[len(FRM_RS):]))
+            writer.close()
+            await writer.wait_closed()
+        print(sorted(str(r['render_id']) for r in replies) == ['None', 'y'] and all(r['status'] == 'error' for r in replies))
+        server = await asyncio.start_server(hang_up, default_host, 0)
+        async with server:
+            client = await RenderClient(port=server.sockets[0].getsockname()[1]).connect()
+            await client._read_task
+            try:
+                await asyncio.wait_for(client.render(Sample('FeedbackQuad', RenderParams(render_id='z'), alpha)), 5)
+                print(False)
+            except ConnectionError:
+                print(True)
+            await client.close()
+
+    asyncio.run(main())
+
+if __name__ == "__main__":
+    test_dispatch()
+    test_bad_lines()
+    test_bad_requests()
@@ -0,0 +1,195 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from .pool import process_pool
+
+log = logging.getLogger(__name__)
+
+
+def sample_path(sample):
+    """Path of a Sample's rendered file."""
+    return os.path.join(os.path.expanduser(sample.render_params['folder']), sample.render_params['filename'])
+
+def file_hash(path, chunk_size=1 << 20):
+    """sha1 of a file's contents."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class RunningStats:
+    """Mean and std of frame values, accumulated block by block."""
+
+    def __init__(self):
+        self.n = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def update(self, frames):
+        frames = np.asarray(frames, dtype=np.float64)
+        self.n += frames.shape[-1]
+        self.total = self.total + frames.sum(axis=-1)
+        self.total_sq = self.total_sq + (frames * frames).sum(axis=-1)
+
+    def mean(self):
+        return self.total / max(self.n, 1)
+
+    def std(self):
+        return np.sqrt(np.maximum(self.total_sq / max(self.n, 1) - self.mean() ** 2, 0.0))
+
+
+def extract(path, n_fft=2048, hop_length=512, block_length=256, n_mfcc=13):
+    """Descriptor summaries for one audio file, read block_length frames at a time.
+
+    Returns mean and std over frames of spectral centroid, flatness, RMS and
+    each MFCC.
+    """
+    import librosa
+    sr = librosa.get_samplerate(path)
+    stats = OrderedDict((name, RunningStats()) for name in ('centroid', 'flatness', 'rms', 'mfcc'))
+    mel = librosa.filters.mel(sr=sr, n_fft=n_fft)
+    blocks = librosa.stream(path, block_length=block_length, frame_length=n_fft, hop_length=hop_length,
+                            mono=True)
+    for y in blocks:
+        if len(y) < n_fft:
+            continue
+        S = np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length, center=False))
+        stats['centroid'].update(librosa.feature.spectral_centroid(S=S, sr=sr, n_fft=n_fft)[0])
+        stats['flatness'].update(librosa.feature.spectral_flatness(S=S)[0])
+        stats['rms'].update(librosa.feature.rms(y=y, frame_length=n_fft, hop_length=hop_length, center=False)[0])
+        stats['mfcc'].update(librosa.feature.mfcc(S=librosa.power_to_db(mel @ S ** 2), n_mfcc=n_mfcc))
+    features = OrderedDict()
+    for name in ('centroid', 'flatness', 'rms'):
+        features[name + '_mean'] = float(stats[name].mean())
+        features[name + '_std'] = float(stats[name].std())
+    for i,(m, s) in enumerate(zip(np.atleast_1d(stats['mfcc'].mean()), np.atleast_1d(stats['mfcc'].std()))):
+        features['mfcc{}_mean'.format(i)] = float(m)
+        features['mfcc{}_std'.format(i)] = float(s)
+    return features
+
+
+class FeatureStore:
+    """Features keyed by render_id and the rendered file's content hash. Appends to a JSON-Lines file."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.data = dict()
+        if os.path.exists(filename):
+            with open(filename) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line, object_pairs_hook=OrderedDict)
+                        self.data[record['render_id']] = record
+
+    def get(self, render_id, content_hash):
+        """Features if stored for this exact file, else None."""
+        record = self.data.get(render_id)
+        if record is None or record['hash'] != content_hash:
+            return None
+        return record['features']
+
+    def put(self, render_id, content_hash, features):
+        record = OrderedDict([('render_id', render_id), ('hash', content_hash), ('features', features)])
+        self.data[render_id] = record
+        with open(self.filename, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def __contains__(self, render_id):
+        return render_id in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+
+def _extract_job(job, kwargs):
+    """Hash one file and extract its features unless the hash is stored_hash.
+
+    Returns (render_id, content_hash, features, error). features is None when
+    the stored ones still apply or on error, error is None on success.
+    """
+    render_id, path, stored_hash = job
+    content_hash = None
+    try:
+        content_hash = file_hash(path)
+        if content_hash == stored_hash:
+            return render_id, content_hash, None, None
+        return render_id, content_hash, extract(path, **kwargs), None
+    except Exception as e:
+        return render_id, content_hash, None, '{}: {}'.format(type(e).__name__, e)
+
+def extract_all(samples, store, workers=None, **kwargs):
+    """Extract features for samples on a process pool, skipping those already in store.
+
+    Files are hashed in the workers too. Returns {render_id: features}.
+    Samples whose file is missing or fails to extract are left out, the
+    failures are logged. workers is as for rpp.pool, 0 runs here. kwargs go
+    to extract.
+    """
+    jobs = []
+    for sample in samples:
+        render_id = sample.render_params['render_id']
+        path = sample_path(sample)
+        if os.path.exists(path):
+            record = store.data.get(render_id)
+            jobs.append((render_id, path, record['hash'] if record is not None else None))
+    results = dict()
+    if not jobs:
+        return results
+    job = functools.partial(_extract_job, kwargs=kwargs)
+    pool = process_pool(workers)
+    try:
+        done = map(job, jobs) if pool is None else pool.map(job, jobs)
+        for render_id, content_hash, features, error in done:
+            if error is not None:
+                log.warning('Feature extraction failed for %s: %s', render_id, error)
+            elif features is None:
+                results[render_id] = store.get(render_id, content_hash)
+            else:
+                store.put(render_id, content_hash, features)
+                results[render_id] = features
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return results
+
+
+def test_features():
+    import tempfile
+    import wave
+    from .params import Sample, RenderParams, FeedbackQuadParams
+    tmp = tempfile.mkdtemp()
+    sr = 22050
+    t = np.arange(sr * 2) / sr
+    samples = []
+    for i, freq in enumerate([220.0, 880.0]):
+        with wave.open(os.path.join(tmp, '{}.wav'.format(i)), 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(sr)
+            w.writeframes((np.sin(2 * np.pi * freq * t) * 16000).astype('<i2').tobytes())
+        samples.append(Sample('FeedbackQuad', RenderParams(render_id=str(i), folder=tmp, filename='{}.wav'.format(i), duration=2.0),
+                              FeedbackQuadParams.default_params()))
+    store = FeatureStore(os.path.join(tmp, 'features.jsonl'))
+    results = extract_all(samples, store, workers=2)
+    print(results['0']['centroid_mean'] < results['1']['centroid_mean'])
+    print(abs(results['0']['rms_mean'] - 16000 / 32768 / np.sqrt(2)) < 0.05)
+    print(extract_all(samples, FeatureStore(store.filename), workers=2) == results)
+    with open(os.path.join(tmp, 'bad.wav'), 'wb') as f:
+        f.write(b'not a wav file')
+    bad = Sample('FeedbackQuad', RenderParams(render_id='bad', folder=tmp, filename='bad.wav'), FeedbackQuadParams.default_params())
+    logging.disable(logging.WARNING)
+    try:
+        print(extract_all(samples + [bad], FeatureStore(store.filename), workers=0) == results)
+    finally:
+        logging.disable(logging.NOTSET)
+
+if __name__ == "__main__":
+    test_features()
@@ -0,0 +1,329 @@
+"""Opt-in timing and counting for the hot paths.
+
+Nothing is wrapped until enable() is called: it swaps timing wrappers onto
+the methods in hot_paths and disable() puts the originals back, so with
+instrumentation off the hot paths run exactly as written. timer() and count()
+are for ad hoc use and cost one flag check when off.
+
+Methods are patched on their class, so every caller sees the wrapper.
+Module-level functions are patched on their module only: a caller that did
+`from rpp.wire import encode_params_into` before enable() keeps the raw
+function and is not timed. Call those thru the module, eg. wire.encode_params_into.
+
+Sinks never run inside a timed call. While enabled with sinks, a daemon
+thread hands them a snapshot every interval seconds, and disable() and the
+end of profile() hand them a last one.
+
+    with instrument.profile() as metrics:
+        quad.randomize(keys)
+    print(metrics.summary())
+"""
+import contextlib
+import functools
+import importlib
+import inspect
+import json
+import threading
+import time
+from collections import Counter, OrderedDict
+
+
+# (module, owner, attribute, metric name). owner None means a module-level function.
+hot_paths = [
+    ('rpp.spec', 'ControlSpec', 'map_spec', 'spec.map_spec'),
+    ('rpp.spec', 'ControlSpec', 'unmap_spec', 'spec.unmap_spec'),
+    ('rpp.spec', 'ControlSpec', 'map_batch', 'spec.map_batch'),
+    ('rpp.spec', 'ControlSpec', 'unmap_batch', 'spec.unmap_batch'),
+    ('rpp.params', 'FeedbackParams', 'randomize', 'params.randomize'),
+    ('rpp.params', 'FeedbackParams', 'serialize', 'params.serialize'),
+    ('rpp.params', 'FeedbackParams', 'to_json', 'params.to_json'),
+    ('rpp.params', 'FeedbackParams', 'from_json', 'params.from_json'),
+    ('rpp.params', 'FeedbackQuadParams', 'randomize', 'quad.randomize'),
+    ('rpp.params', 'FeedbackQuadParams', 'randomize_batch', 'quad.randomize_batch'),
+    ('rpp.params', 'FeedbackQuadParams', 'serialize', 'quad.serialize'),
+    ('rpp.params', 'FeedbackQuadParams', 'to_json', 'quad.to_json'),
+    ('rpp.params', 'Sample', 'to_json', 'sample.to_json'),
+    ('rpp.params', 'Sample', 'from_json', 'sample.from_json'),
+    ('rpp.codec', 'SampleCodec', 'encode', 'codec.encode'),
+    ('rpp.codec', 'SampleCodec', 'decode', 'codec.decode'),
+    ('rpp.wire', None, 'encode_params_into', 'wire.encode_params_into'),
+    ('rpp.dispatch', 'RenderClient', 'render', 'dispatch.render'),
+]
+
+
+class Histogram:
+    """Latency histogram with power-of-two nanosecond buckets."""
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.buckets[int(seconds * 1e9).bit_length()] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """Upper edge, in seconds, of the bucket holding the q-th percentile."""
+        if not self.count:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return (1 << bucket) / 1e9
+        return self.max
+
+    def summary(self):
+        return OrderedDict([
+            ('count', self.count),
+            ('total', self.total),
+            ('mean', self.total / self.count if self.count else 0.0),
+            ('p50', self.percentile(50)),
+            ('p99', self.percentile(99)),
+            ('max', self.max),
+        ])
+
+
+class MemorySink:
+    """Keeps every emitted snapshot."""
+
+    def __init__(self):
+        self.snapshots = []
+
+    def emit(self, snapshot):
+        self.snapshots.append(snapshot)
+
+
+class JsonDumpSink:
+    """Overwrites filename with the latest snapshot."""
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def emit(self, snapshot):
+        with open(self.filename, 'w') as f:
+            json.dump(snapshot, f, indent=2)
+
+
+class CallbackSink:
+    def __init__(self, callback):
+        self.callback = callback
+
+    def emit(self, snapshot):
+        self.callback(snapshot)
+
+
+# Shortest wait between periodic emits, whatever the interval.
+min_interval = 0.01
+
+class Metrics:
+    """Counters and latency histograms. Between start() and stop() the sinks get a snapshot every interval seconds."""
+
+    def __init__(self, sinks=(), interval=10.0):
+        self.counters = Counter()
+        self.timers = dict()
+        self.sinks = list(sinks)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self._stop = None
+        self._thread = None
+
+    def record(self, name, seconds):
+        with self.lock:
+            hist = self.timers.get(name)
+            if hist is None:
+                hist = self.timers[name] = Histogram()
+            hist.add(seconds)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def summary(self):
+        with self.lock:
+            return OrderedDict([
+                ('counters', dict(self.counters)),
+                ('timers', OrderedDict((name, hist.summary()) for name, hist in sorted(self.timers.items()))),
+            ])
+
+    def emit(self):
+        """Send a snapshot to the sinks now."""
+        snapshot = self.summary()
+        for sink in self.sinks:
+            sink.emit(snapshot)
+
+    def flush(self):
+        """Send a current snapshot to the sinks, if there are any."""
+        if self.sinks:
+            self.emit()
+
+    def start(self):
+        """Emit to the sinks every interval seconds from a daemon thread, until stop()."""
+        if self._thread is not None:
+            return
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), name='rpp-metrics', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._stop = self._thread = None
+
+    def _run(self, stop):
+        while not stop.wait(max(self.interval, min_interval)):
+            self.flush()
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.timers.clear()
+
+
+metrics = Metrics()
+enabled = False
+_originals = []
+
+def _wrap(func, name, clock=time.perf_counter):
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                metrics.record(name, clock() - start)
+    else:
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics.record(name, clock() - start)
+    return timed
+
+def enable(paths=None, sinks=None, interval=None):
+    """Wrap the hot paths (default all of hot_paths) with timers and start emitting to the sinks.
+
+    Already enabled, sinks and interval still apply, the wrappers stay as they are.
+    """
+    global enabled
+    if sinks is not None:
+        metrics.sinks = list(sinks)
+    if interval is not None:
+        metrics.interval = interval
+    metrics.start()
+    if enabled:
+        return metrics
+    for module_name, owner_name, attr, name in (hot_paths if paths is None else paths):
+        module = importlib.import_module(module_name)
+        owner = module if owner_name is None else getattr(module, owner_name)
+        raw = owner.__dict__[attr] if owner_name is not None else getattr(owner, attr)
+        if isinstance(raw, classmethod):
+            wrapped = classmethod(_wrap(raw.__func__, name))
+        elif isinstance(raw, staticmethod):
+            wrapped = staticmethod(_wrap(raw.__func__, name))
+        else:
+            wrapped = _wrap(raw, name)
+        _originals.append((owner, attr, raw))
+        setattr(owner, attr, wrapped)
+    enabled = True
+    return metrics
+
+def disable():
+    """Put the original hot paths back, stop the periodic emits and flush the sinks."""
+    global enabled
+    metrics.stop()
+    while _originals:
+        owner, attr, raw = _originals.pop()
+        setattr(owner, attr, raw)
+    if enabled:
+        metrics.flush()
+    enabled = False
+
+@contextlib.contextmanager
+def profile(paths=None, sinks=None, reset=True):
+    """Instrument the hot paths for the duration of the block. Yields the Metrics.
+
+    Inside an enable() the sinks are flushed at the end and then put back.
+    """
+    was_enabled = enabled
+    old_sinks = metrics.sinks
+    if reset:
+        metrics.reset()
+    enable(paths, sinks)
+    try:
+        yield metrics
+    finally:
+        if not was_enabled:
+            disable()
+        else:
+            metrics.flush()
+            metrics.sinks = old_sinks
+
+@contextlib.contextmanager
+def timer(name):
+    """Time a block under name. A flag check when instrumentation is off."""
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.record(name, time.perf_counter() - start)
+
+def count(name, n=1):
+    if enabled:
+        metrics.count(name, n)
+
+
+def test_instrument():
+    from .params import FeedbackQuadParams
+    from .spec import ControlSpec
+    original = ControlSpec.map_spec
+    alpha = FeedbackQuadParams.default_params()
+    snapshots = []
+    with profile(sinks=[CallbackSink(snapshots.append)]) as m:
+        alpha.randomize(['koscR', 'lfoCSwitch'])
+        with timer('custom'):
+            count('things', 3)
+    print(m.timers['quad.randomize'].count == 1 and m.timers['spec.map_spec'].count == 8)
+    print(m.counters['things'] == 3 and 'custom' in m.timers)
+    print(ControlSpec.map_spec is original and not enabled)
+    print(len(snapshots) == 1 and snapshots[0]['timers']['params.randomize']['count'] == 4)
+    inline, outer, inner = [], [], []
+    enable(sinks=[CallbackSink(outer.append)], interval=60.0)
+    try:
+        with profile(sinks=[CallbackSink(inner.append)]):
+            with timer('a'):
+                pass
+            with timer('a'):
+                inline.append(len(inner))
+        print(inline == [0] and len(inner) == 1 and inner[-1]['timers']['a']['count'] == 2)
+    finally:
+        disable()
+    print(len(outer) == 1 and not enabled and metrics._thread is None)
+    periodic = []
+    enable(paths=[], sinks=[CallbackSink(periodic.append)], interval=0.02)
+    try:
+        count('ticks')
+        deadline = time.monotonic() + 5.0
+        while len(periodic) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        print(len(periodic) >= 2 and periodic[0]['counters']['ticks'] == 1)
+    finally:
+        disable()
+
+if __name__ == "__main__":
+    test_instrument()
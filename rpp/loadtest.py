@@ -0,0 +1,153 @@
+"""Sustained-load driver for the render pipeline.
+
+    python -m rpp.loadtest --samples 5000 --in-flight 32 --mock --latency 0.02
+    python -m rpp.loadtest --port 7878 --duration 1.0      # against a running renderer
+
+Keeps in-flight renders going until samples have been sent and reports
+samples/sec, p50/p99 latency and memory growth per window of samples. --mock
+starts a python -m rpp.mock process to render against; the other mock
+options are passed on to it.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .dispatch import RenderClient, default_host, default_port
+from .params import FeedbackQuadParams, RenderParams, Sample, param_keys
+from .spec import rust_spec
+
+
+def rss():
+    """Resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        # Peak, not current, where there is no /proc. Kilobytes on Linux, bytes on macOS.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+def latency_stats(latencies):
+    latencies = np.asarray(latencies)
+    if not len(latencies):
+        return OrderedDict([('count', 0)])
+    return OrderedDict([
+        ('count', len(latencies)),
+        ('p50', float(np.percentile(latencies, 50))),
+        ('p99', float(np.percentile(latencies, 99))),
+        ('max', float(latencies.max())),
+    ])
+
+
+async def run(samples, host=default_host, port=default_port, in_flight=32, duration=0.1, folder='~',
+              window=1000, randorams=param_keys, out=sys.stdout):
+    """Render samples Samples with in_flight always outstanding. Returns a report dict."""
+    spec = rust_spec()
+    alpha = FeedbackQuadParams.default_params()
+    latencies = np.empty(samples)
+    windows = []
+    state = {'next': 0, 'done': 0, 'errors': 0}
+    start = time.perf_counter()
+    window_start = [start, rss()]
+    base_rss = window_start[1]
+
+    def close_window():
+        now, mem = time.perf_counter(), rss()
+        done = state['done']
+        n = done - (windows[-1]['done'] if windows else 0)
+        lat = latency_stats(latencies[done - n:done])
+        row = OrderedDict([('done', done), ('samples_per_sec', n / (now - window_start[0])), ('p50', lat.get('p50')),
+                           ('p99', lat.get('p99')), ('rss', mem), ('rss_growth', mem - base_rss)])
+        windows.append(row)
+        if out is not None:
+            print('{:>8} done {:>9.1f}/s  p50 {:>8.2f} ms  p99 {:>8.2f} ms  rss {:>8.1f} MB  {:+.1f} MB'.format(
+                done, row['samples_per_sec'], 1e3 * (row['p50'] or 0), 1e3 * (row['p99'] or 0),
+                mem / 2**20, (mem - base_rss) / 2**20), file=out)
+        window_start[:] = [now, mem]
+
+    async with RenderClient(host, port, max_in_flight=in_flight) as client:
+        async def worker():
+            while state['next'] < samples:
+                i = state['next']
+                state['next'] += 1
+                sample = Sample('FeedbackQuad', RenderParams(render_id='load{}'.format(i), folder=folder,
+                                                              filename='load{}.wav'.format(i % 1000), duration=duration),
+                                alpha.randomize(randorams, spec=spec))
+                sent = time.perf_counter()
+                try:
+                    await client.render(sample)
+                except Exception:
+                    state['errors'] += 1
+                latencies[state['done']] = time.perf_counter() - sent
+                state['done'] += 1
+                if state['done'] % window == 0:
+                    close_window()
+
+        await asyncio.gather(*[worker() for i in range(in_flight)])
+    if state['done'] % window:
+        close_window()
+    elapsed = time.perf_counter() - start
+    report = OrderedDict([('samples', samples), ('errors', state['errors']), ('seconds', elapsed),
+                          ('samples_per_sec', samples / elapsed)])
+    lat = latency_stats(latencies)
+    report.update(('latency_' + k, lat.get(k)) for k in ('p50', 'p99', 'max'))
+    steady = windows[len(windows) // 2:] if len(windows) > 1 else windows
+    report['rss_growth'] = windows[-1]['rss_growth'] if windows else 0
+    report['rss_growth_per_1k'] = ((steady[-1]['rss'] - steady[0]['rss']) * 1000.0 /
+                                   max(steady[-1]['done'] - steady[0]['done'], 1)) if len(steady) > 1 else 0.0
+    report['windows'] = windows
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m rpp.loadtest', description='Sustained-load test against a renderer.')
+    parser.add_argument('--samples', type=int, default=5000)
+    parser.add_argument('--in-flight', type=int, default=32)
+    parser.add_argument('--window', type=int, default=1000, help='report every this many samples')
+    parser.add_argument('--duration', type=float, default=0.1, help='RenderParams duration, seconds')
+    parser.add_argument('--folder', default='~', help='RenderParams folder')
+    parser.add_argument('--host', default=default_host)
+    parser.add_argument('--port', type=int, default=default_port)
+    parser.add_argument('--mock', action='store_true', help='start python -m rpp.mock and test against it')
+    parser.add_argument('--latency', type=float, default=0.0, help='mock: seconds added to every render')
+    parser.add_argument('--jitter', type=float, default=0.0, help='mock: up to this many more seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='mock: fraction of renders that fail')
+    parser.add_argument('--write', action='store_true', help='mock: write WAVs, to --folder')
+    parser.add_argument('--out', help='write the report as JSON here')
+    args = parser.parse_args(argv)
+
+    proc, port = None, args.port
+    if args.mock:
+        from .mock import spawn
+        mock_args = ['--latency', args.latency, '--jitter', args.jitter, '--failure-rate', args.failure_rate,
+                     '--max-workers', args.in_flight]
+        if args.write:
+            mock_args += ['--out', os.path.expanduser(args.folder)]
+        else:
+            mock_args.append('--no-write')
+        proc, port = spawn(*mock_args)
+    try:
+        report = asyncio.run(run(args.samples, args.host, port, args.in_flight, args.duration, args.folder,
+                                 args.window))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+    print('{samples} samples, {errors} errors in {seconds:.2f} s: {samples_per_sec:.1f} samples/s, '
+          'p50 {p50:.2f} ms, p99 {p99:.2f} ms, rss {growth:+.1f} MB ({per_1k:+.1f} kB per 1k in steady state)'.format(
+              p50=1e3 * (report['latency_p50'] or 0), p99=1e3 * (report['latency_p99'] or 0), growth=report['rss_growth'] / 2**20,
+              per_1k=report['rss_growth_per_1k'] / 1024, **report))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""Stand-in for the Rust renderer, for load tests without audio hardware.
+
+    python -m rpp.mock --port 7878 --latency 0.05 --jitter 0.02 --failure-rate 0.01
+
+Speaks the rpp.dispatch line protocol thru RenderServer and writes a
+synthetic mono WAV of RenderParams duration seconds for each Sample, to the
+Sample's folder and filename unless --out is given. Prints
+'listening on HOST:PORT' once it is ready.
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import wave
+
+import numpy as np
+
+from .dispatch import RenderServer, default_host, default_port
+
+
+class MockRenderer:
+    """render_func for RenderServer with injected latency and failures.
+
+    Each render waits latency + uniform(0, jitter) + realtime * duration
+    seconds and fails with probability failure_rate. WAVs are written on a
+    thread so slow disks do not stall the event loop.
+    """
+
+    def __init__(self, out=None, sr=22050, latency=0.0, jitter=0.0, realtime=0.0, failure_rate=0.0,
+                 write=True, seed=None):
+        self.out = out
+        self.sr = sr
+        self.latency = latency
+        self.jitter = jitter
+        self.realtime = realtime
+        self.failure_rate = failure_rate
+        self.write = write
+        self.random = random.Random(seed)
+        self.rendered = 0
+        self.failed = 0
+
+    def path(self, sample):
+        rp = sample.render_params
+        folder = self.out if self.out is not None else os.path.expanduser(rp['folder'])
+        return os.path.join(folder, rp['filename'])
+
+    def write_wav(self, path, duration, freq):
+        """Sine at freq, duration seconds, written a second at a time."""
+        frames = int(round(duration * self.sr))
+        with wave.open(path, 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(self.sr)
+            for start in range(0, frames, self.sr):
+                t = np.arange(start, min(start + self.sr, frames)) / self.sr
+                w.writeframes((np.sin(2 * np.pi * freq * t) * 16000).astype('<i2').tobytes())
+        return frames
+
+    async def __call__(self, sample):
+        duration = float(sample.render_params['duration'])
+        delay = self.latency + self.random.uniform(0.0, self.jitter) + self.realtime * duration
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.random.random() < self.failure_rate:
+            self.failed += 1
+            raise RuntimeError('injected failure')
+        path = self.path(sample)
+        frames = 0
+        if self.write:
+            freq = 55.0 * 2 ** (8 * sample.synth_params[0]['koscFreq'])
+            frames = await asyncio.get_running_loop().run_in_executor(None, self.write_wav, path, duration, freq)
+        self.rendered += 1
+        return {'filename': path, 'frames': frames}
+
+
+def spawn(*args):
+    """Start python -m rpp.mock with args in a subprocess. Returns (process, port)."""
+    proc = subprocess.Popen([sys.executable, '-m', 'rpp.mock', '--port', '0'] + [str(a) for a in args],
+                            stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline()
+    if not line.startswith('listening on '):
+        proc.kill()
+        raise RuntimeError('Mock renderer failed to start')
+    return proc, int(line.rsplit(':', 1)[1])
+
+
+async def serve(renderer, host=default_host, port=default_port, max_workers=64):
+    async with RenderServer(renderer, host, port, max_workers) as server:
+        print('listening on {}:{}'.format(server.host, server.port), flush=True)
+        await server.server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m rpp.mock', description='Stand-in renderer for load tests.')
+    parser.add_argument('--host', default=default_host)
+    parser.add_argument('--port', type=int, default=default_port, help='0 picks a free port')
+    parser.add_argument('--out', help='write every WAV here instead of the Sample folder')
+    parser.add_argument('--sr', type=int, default=22050)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every render')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many more seconds, uniform')
+    parser.add_argument('--realtime', type=float, default=0.0, help='seconds per second of audio')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--no-write', action='store_true', help='reply without writing WAVs')
+    parser.add_argument('--max-workers', type=int, default=64)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+    if args.out is not None:
+        os.makedirs(args.out, exist_ok=True)
+    renderer = MockRenderer(args.out, args.sr, args.latency, args.jitter, args.realtime, args.failure_rate,
+                            not args.no_write, args.seed)
+    try:
+        asyncio.run(serve(renderer, args.host, args.port, args.max_workers))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def test_mock():
+    import tempfile
+    from .dispatch import RenderClient, RenderError
+    from .params import FeedbackQuadParams, RenderParams, Sample
+    tmp = tempfile.mkdtemp()
+    alpha = FeedbackQuadParams.default_params()
+    samples = [Sample('FeedbackQuad', RenderParams(render_id=str(i), folder=tmp, filename='{}.wav'.format(i),
+                                                   duration=0.5), alpha) for i in range(20)]
+    proc, port = spawn('--sr', 8000, '--latency', 0.01, '--failure-rate', 0.2, '--seed', 1)
+
+    async def main():
+        async with RenderClient(port=port, max_in_flight=8) as client:
+            return await client.render_many(samples, return_exceptions=True)
+
+    try:
+        replies = asyncio.run(main())
+    finally:
+        proc.terminate()
+        proc.wait()
+    ok = [r for r in replies if not isinstance(r, Exception)]
+    print(0 < len(ok) < 20 and all(isinstance(r, RenderError) for r in replies if isinstance(r, Exception)))
+    with wave.open(ok[0]['filename']) as w:
+        print(w.getnframes() == 4000 and ok[0]['frames'] == 4000)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,16 @@
 from . spec import rust_spec
 
 from collections import OrderedDict
+from collections.abc import MutableMapping
+from array import array
+import itertools
 import random
-import copy
+import time
 import csv
 import functools
 
+import numpy as np
+
 
 abbr = {
     'koscR': 'r  ',
@@ -34,61 +39,146 @@ abbr = {
     'outZ': 'oZ',
 }
 
+snake_case = {
+    'koscR': 'kosc_r',
+    'koscFreq': 'kosc_freq',
+    'koscError': 'kosc_error',
+    'lowPassPot': 'lowpass_pot',
+    'preAmpPot': 'preamp_pot',
+    'powAmpPot': 'powamp_pot',
+    'lfoPot': 'lfo_pot',
+    'lfoCSwitch': 'lfo_cswitch',
+    'lfoWidth': 'lfo_width',
+    'lfoIPhase': 'lfo_iphase',
+    'lfoLowPassPot': 'lfo_lowpass_pot',
+    'vactrolAttack': 'vactrol_attack',
+    'vactrolDecay': 'vactrol_decay',
+    'vactrolHysteresis': 'vactrol_hysteresis',
+    'vactrolDepth': 'vactrol_depth',
+    'vactrolScalar': 'vactrol_scalar',
+    'lfoGate': 'lfo_gate',
+    'vactrolGate': 'vactrol_gate',
+    'fbackScalars': 'fback_scalars',
+    'outScalars': 'out_scalars',
+}
+
+camel_case = {v: k for k,v in snake_case.items()}
+
 def to_snake_case(k):
-    x = {
-        'koscR': 'kosc_r',
-        'koscFreq': 'kosc_freq',
-        'koscError': 'kosc_error',
-        'lowPassPot': 'lowpass_pot',
-        'preAmpPot': 'preamp_pot',
-        'powAmpPot': 'powamp_pot',
-        'lfoPot': 'lfo_pot',
-        'lfoCSwitch': 'lfo_cswitch',
-        'lfoWidth': 'lfo_width',
-        'lfoIPhase': 'lfo_iphase',
-        'lfoLowPassPot': 'lfo_lowpass_pot',
-        'vactrolAttack': 'vactrol_attack',
-        'vactrolDecay': 'vactrol_decay',
-        'vactrolHysteresis': 'vactrol_hysteresis',
-        'vactrolDepth': 'vactrol_depth',
-        'vactrolScalar': 'vactrol_scalar',
-        'lfoGate': 'lfo_gate',
-        'vactrolGate': 'vactrol_gate',
-        'fbackScalars': 'fback_scalars',
-        'outScalars': 'out_scalars',
-    }
-    return x[k] if k in x else k
+    return snake_case.get(k, k)
 
 def to_camel_case(k):
-    x = {
-        'kosc_r': 'koscR',
-        'kosc_freq': 'koscFreq',
-        'kosc_error': 'koscError',
-        'lowpass_pot': 'lowPassPot',
-        'preamp_pot': 'preAmpPot',
-        'powamp_pot': 'powAmpPot',
-        'lfo_pot': 'lfoPot',
-        'lfo_cswitch': 'lfoCSwitch',
-        'lfo_width': 'lfoWidth',
-        'lfo_iphase': 'lfoIPhase',
-        'lfo_lowpass_pot': 'lfoLowPassPot',
-        'vactrol_attack': 'vactrolAttack',
-        'vactrol_decay': 'vactrolDecay',
-        'vactrol_hysteresis': 'vactrolHysteresis',
-        'vactrol_depth': 'vactrolDepth',
-        'vactrol_scalar': 'vactrolScalar',
-        'lfo_gate': 'lfoGate',
-        'vactrol_gate': 'vactrolGate',
-        'fback_scalars': 'fbackScalars',
-        'out_scalars': 'outScalars',
-    }
-    return x[k] if k in x else k
+    return camel_case.get(k, k)
+
+param_keys = (
+    'koscR',
+    'koscFreq',
+    'koscError',
+    'lowPassPot',
+    'preAmpPot',
+    'powAmpPot',
+    'lfoPot',
+    'lfoCSwitch',
+    'lfoWidth',
+    'lfoIPhase',
+    'lfoLowPassPot',
+    'vactrolAttack',
+    'vactrolDecay',
+    'vactrolHysteresis',
+    'vactrolDepth',
+    'vactrolScalar',
+    'lfoGate',
+    'vactrolGate',
+    'fbackX',
+    'fbackY',
+    'fbackZ',
+    'outX',
+    'outY',
+    'outZ',
+)
+
+param_index = {k: i for i,k in enumerate(param_keys)}
+
+all_dirty = (1 << len(param_keys)) - 1
+
+@functools.lru_cache(1)
+def _default_spec():
+    """rust_spec(), built once, for the methods called without a spec. Don't add to it."""
+    return rust_spec()
+
+# Switches the Rust side reads as integers. Whole values go out as ints in to_json.
+int_index = tuple(param_index[k] for k,elem in _default_spec().data.items() if elem.curve == 'binary')
+
+class ParamsView(MutableMapping):
+    """Dict-style view onto the buffer of a FeedbackParams."""
+    __slots__ = ('_owner',)
+
+    def __init__(self, owner):
+        self._owner = owner
+
+    def __getitem__(self, key):
+        return self._owner[key]
+
+    def __setitem__(self, key, val):
+        self._owner[key] = val
+
+    def __delitem__(self, key):
+        raise TypeError('FeedbackParams keys are fixed')
+
+    def __iter__(self):
+        return iter(param_keys)
+
+    def __len__(self):
+        return len(param_keys)
+
+    def __contains__(self, key):
+        return key in param_index
+
+    def keys(self):
+        return param_keys
+
+    def values(self):
+        return self._owner._buf.tolist()
+
+    def items(self):
+        return zip(param_keys, self._owner._buf.tolist())
+
+    def __repr__(self):
+        return 'OrderedDict({!r})'.format(list(self.items()))
 
 class FeedbackParams:
+    """24 feedback params in one contiguous float64 buffer.
+
+    Writes thru __setitem__ set a dirty bit per index, see flush_changes.
+    Every constructor and loader returns a clean object, with nothing to
+    send until a param is written. mark_dirty forces a full resend.
+    """
+    __slots__ = ('_buf', '_dirty')
     size = 24
 
     def __init__(self, params_dict):
         self.params = params_dict
+        self._dirty = 0
+
+    @classmethod
+    def _from_buffer(cls, buf):
+        """Wrap a float64 array.array without copying."""
+        fbp = cls.__new__(cls)
+        fbp._buf = buf
+        fbp._dirty = 0
+        return fbp
+
+    @property
+    def params(self):
+        return ParamsView(self)
+
+    @params.setter
+    def params(self, params_dict):
+        for k in params_dict.keys():
+            if k not in param_index:
+                raise LookupError('Key \'{}\' not found in params dict'.format(k))
+        self._buf = array('d', [params_dict[k] for k in param_keys])
+        self._dirty = all_dirty
 
     @classmethod
     def from_dict(cls, params_dict):
@@ -96,6 +186,7 @@ class FeedbackParams:
         fbp = cls.default_params()
         for k,v in params_dict.items():
             fbp.params[k] = v
+        fbp._dirty = 0
         return fbp
 
     @classmethod
@@ -129,80 +220,82 @@ class FeedbackParams:
 
         if spec is not None:
             for k in spec.keys():
-                pdict[k] = spec[k].default if spec[k].default is not None else pdict[k]
+                if k in pdict:
+                    pdict[k] = spec[k].default if spec[k].default is not None else pdict[k]
 
         return cls(pdict)
 
     @classmethod
     def from_list(cls, plist):
-        return cls(
-            OrderedDict([
-                ('koscR', plist[0]),
-                ('koscFreq', plist[1]),
-                ('koscError', plist[2]),
-                ('lowPassPot', plist[3]),
-                ('preAmpPot', plist[4]),
-                ('powAmpPot', plist[5]),
-                ('lfoPot', plist[6]),
-                ('lfoCSwitch', plist[7]),
-                ('lfoWidth', plist[8]),
-                ('lfoIPhase', plist[9]),
-                ('lfoLowPassPot', plist[10]),
-                ('vactrolAttack', plist[11]),
-                ('vactrolDecay', plist[12]),
-                ('vactrolHysteresis', plist[13]),
-                ('vactrolDepth', plist[14]),
-                ('vactrolScalar', plist[15]),
-                ('lfoGate', plist[16]),
-                ('vactrolGate', plist[17]),
-                ('fbackX', plist[18]),
-                ('fbackY', plist[19]),
-                ('fbackZ', plist[20]),
-                ('outX', plist[21]),
-                ('outY', plist[22]),
-                ('outZ', plist[23]),
-            ])
-        )
+        buf = array('d', plist[:cls.size])
+        if len(buf) != cls.size:
+            raise ValueError('Expected {} params, got {}'.format(cls.size, len(buf)))
+        return cls._from_buffer(buf)
+
+    def copy(self):
+        """Return a copy, dirty bits included."""
+        fbp = FeedbackParams._from_buffer(array('d', self._buf))
+        fbp._dirty = self._dirty
+        return fbp
+
+    __copy__ = copy
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def freeze(self):
+        """Immutable snapshot, see FrozenParams."""
+        return FrozenParams(self._buf)
 
     def map_spec(self, spec):
         """Map thru the spec. Returns a new copy."""
-        return FeedbackParams(OrderedDict([(k, spec.map_spec(k, v)) for k,v in self.params.items()]))
+        return FeedbackParams.from_list(spec.map_batch(param_keys, self.to_vec()[None, :])[0])
 
-    def randomize(self, randorams, spec=rust_spec()):
+    def randomize(self, randorams, spec=None):
         """Randomize randorams. Returns a new copy."""
-        beta = copy.deepcopy(self)
+        spec = _default_spec() if spec is None else spec
+        beta = FeedbackParams._from_buffer(array('d', self._buf))
         for k in randorams:
-            beta.params[k] = spec.map_spec(k, random.random())
+            beta._buf[param_index[k]] = spec.map_spec(k, random.random())
         return beta
 
     def serialize(self):
-        """Convert to list. For sending data over the network."""
-        return [v for v in self.params.values()]
+        """Convert to memoryview over the buffer. For sending data over the network."""
+        return memoryview(self._buf)
 
     def to_vec(self, params=None, unmap=False, spec=None):
-        """Convert to vector. For data analysis."""
-        params = self.params.keys() if params is None else params
-        map_func = (lambda k,v: spec.unmap_spec(k, v)) if unmap is True else (lambda k,v: v)
-        return [map_func(k, v) for k,v in self.params.items() if k in params]
+        """Convert to vector. For data analysis.
+
+        Not subset or unmapped, it is a read-only view of the params, since
+        writes thru it would skip the dirty bits. Copy it to change it.
+        """
+        vec = np.frombuffer(self._buf, dtype=np.float64)
+        vec.flags.writeable = False
+        if params is not None:
+            keys = [k for k in param_keys if k in params]
+            vec = vec[[param_index[k] for k in keys]]
+        else:
+            keys = param_keys
+        if unmap is True:
+            vec = spec.unmap_batch(keys, vec[None, :])[0]
+        return vec
 
     def to_dataframe(self, params=None, unmap=False, spec=None, suffix=''):
         """Convert to dataframe. For data analysis."""
-        params = self.params.keys() if params is None else params
-        map_func = (lambda k,v: spec.unamp_spec(k, v)) if unmap is True else (lambda k,v: v)
+        params = param_keys if params is None else params
+        map_func = (lambda k,v: spec.unmap_spec(k, v)) if unmap is True else (lambda k,v: v)
         return OrderedDict([('{0}{1}'.format(k, suffix), map_func(k, v))
-                            for k,v in self.params.items() if k in params])
+                            for k,v in zip(param_keys, self._buf) if k in params])
 
     def to_json(self):
         """Return a json serializable format."""
-        rs_dict = OrderedDict([(to_snake_case(k), v) for k,v in self.params.items()])
-        del rs_dict['fbackX']
-        del rs_dict['fbackY']
-        del rs_dict['fbackZ']
-        del rs_dict['outX']
-        del rs_dict['outY']
-        del rs_dict['outZ']
-        rs_dict.update({'fback_scalars': [self.params['fbackX'], self.params['fbackY'], self.params['fbackZ']]})
-        rs_dict.update({'out_scalars': [self.params['outX'], self.params['outY'], self.params['outZ']]})
+        vals = self._buf.tolist()
+        for i in int_index:
+            if vals[i].is_integer():
+                vals[i] = int(vals[i])
+        rs_dict = OrderedDict([(to_snake_case(k), v) for k,v in zip(param_keys[:18], vals)])
+        rs_dict.update({'fback_scalars': vals[18:21]})
+        rs_dict.update({'out_scalars': vals[21:24]})
         return rs_dict
 
     @classmethod
@@ -220,47 +313,90 @@ class FeedbackParams:
         return FeedbackParams.from_dict(py_dict)
 
     def keys(self):
-        return self.params.keys()
+        return param_keys
 
     def values(self):
-        return self.params.values()
+        return self._buf.tolist()
 
     def __getitem__(self, key):
-        return self.params[key]
+        return self._buf[param_index[key]]
 
     def __setitem__(self, key, val):
-        if key not in self.params:
+        if key not in param_index:
             raise LookupError('Key \'{}\' not found in params dict'.format(key))
         else:
-            self.params[key] = val
+            i = param_index[key]
+            self._buf[i] = val
+            self._dirty |= 1 << i
+
+    def has_changes(self):
+        return self._dirty != 0
+
+    def changes(self):
+        """(index, value) for every param set since the last flush."""
+        dirty, buf = self._dirty, self._buf
+        return [(i, buf[i]) for i in range(self.size) if dirty >> i & 1]
+
+    def flush_changes(self):
+        """Return changes() and mark everything clean."""
+        changes = self.changes()
+        self._dirty = 0
+        return changes
+
+    def mark_dirty(self, keys=None):
+        """Mark keys, or all params, as changed. Eg. to force a full resend."""
+        if keys is None:
+            self._dirty = all_dirty
+        else:
+            for k in keys:
+                self._dirty |= 1 << param_index[k]
 
     def __repr__(self):
         return '<Params({0.params!r}>'.format(self)
 
 class FeedbackQuadParams:
+    """Four FeedbackParams voices. Replacing a voice marks all of it changed, see flush_changes."""
     size = FeedbackParams.size * 4
 
     def __init__(self, params_dicts):
         self.params = params_dicts
+        self._replaced = 0
 
     @classmethod
     def default_params(cls, spec=None):
         return cls([FeedbackParams.default_params(spec=spec) for i in range(4)])
 
-    def randomize(self, randorams, spec=rust_spec()):
+    def randomize(self, randorams, spec=None):
         """randomize randorams. Returns a new copy."""
-        beta = copy.deepcopy(self)
-        for i in range(len(beta.params)):
-            beta.params[i] = beta.params[i].randomize(randorams, spec=spec)
-        return beta
+        spec = _default_spec() if spec is None else spec
+        return FeedbackQuadParams([p.randomize(randorams, spec=spec) for p in self.params])
+
+    def randomize_batch(self, n, randorams, spec=None, seed=None):
+        """Randomize randorams for n copies at once. Returns an (n, 4, 24) array.
+
+        seed is anything np.random.default_rng takes. Use spawn_seeds to give
+        each parallel worker its own reproducible stream.
+        """
+        spec = _default_spec() if spec is None else spec
+        rng = np.random.default_rng(seed)
+        base = self.to_vec().reshape(len(self.params), FeedbackParams.size)
+        batch = np.tile(base, (n, 1, 1))
+        idx = [param_index[k] for k in randorams]
+        batch[:, :, idx] = spec.map_batch(randorams, rng.random((n, len(self.params), len(idx))))
+        return batch
+
+    @classmethod
+    def from_array(cls, arr):
+        """Create a FeedbackQuadParams from a (4, 24) array, eg. one row of randomize_batch."""
+        return cls([FeedbackParams.from_list(row.tolist()) for row in np.asarray(arr, dtype=np.float64)])
 
     def serialize(self):
         """Convert to list."""
-        return functools.reduce(lambda x,y: x+y, [p.serialize() for p in self.params])
+        return list(itertools.chain.from_iterable(p.serialize() for p in self.params))
 
     def pretty_csv(self, filename='test.csv'):
         """Print as CSV. This is for display purposes NOT save and recall."""
-        with open(filename, 'wb') as f:
+        with open(filename, 'w', newline='') as f:
             wr = csv.writer(f, quoting=csv.QUOTE_ALL)
             wr.writerow([abbr[k] for k in FeedbackParams.default_params().keys()])
             for p in self.params:
@@ -268,15 +404,23 @@ class FeedbackQuadParams:
 
     def to_csv(self, filename='test.csv'):
         """Print as CSV. This is for save and recall."""
-        with open(filename, 'wb') as f:
+        with open(filename, 'w', newline='') as f:
             wr = csv.writer(f, quoting=csv.QUOTE_ALL)
             wr.writerow(FeedbackParams.default_params().keys())
             for p in self.params:
                 wr.writerow(p.values())
 
+    @classmethod
+    def from_csv(cls, filename='test.csv'):
+        """Read back a CSV written by to_csv."""
+        with open(filename, newline='') as f:
+            rd = csv.reader(f)
+            keys = next(rd)
+            return cls([FeedbackParams.from_dict(OrderedDict(zip(keys, map(float, row)))) for row in rd if row])
+
     def to_vec(self, params=None, unmap=False, spec=None):
         """Convert to vector. For data analysis."""
-        return sum([p.to_vec(params=params, unmap=unmap, spec=spec) for p in self.params], [])
+        return np.concatenate([p.to_vec(params=params, unmap=unmap, spec=spec) for p in self.params])
 
     def to_dataframe(self, params=None, unmap=False, spec=None):
         """Convert to dataframe. For data analysis."""
@@ -297,8 +441,14 @@ class FeedbackQuadParams:
         return FeedbackQuadParams([FeedbackParams.from_json(dct) for dct in  list_of_JSON_dicts])
 
     def deepcopy(self):
-        """Return a deep copy. Really just a convenience for copy.deepcopy()."""
-        return copy.deepcopy(self)
+        """Return a deep copy. Copies each voice's buffer, dirty bits included."""
+        quad = FeedbackQuadParams([p.copy() for p in self.params])
+        quad._replaced = self._replaced
+        return quad
+
+    def freeze(self):
+        """Immutable snapshot, see FrozenQuadParams."""
+        return FrozenQuadParams(p.freeze() for p in self.params)
 
     def setall(self, param, val):
         """Set param for all four FeedbackParams. Returns self."""
@@ -311,11 +461,230 @@ class FeedbackQuadParams:
 
     def __setitem__(self, index, val):
         self.params[index] = val
+        self._replaced |= 1 << range(len(self.params))[index]
+
+    def has_changes(self):
+        return self._replaced != 0 or any(p.has_changes() for p in self.params)
+
+    def flush_changes(self):
+        """(voice, index, value) for every param set, or voice replaced, since the last flush.
+
+        Marks everything clean.
+        """
+        changes = []
+        for v,p in enumerate(self.params):
+            voice = p.flush_changes()
+            if self._replaced >> v & 1:
+                voice = list(enumerate(p.values()))
+            changes.extend((v, i, x) for i,x in voice)
+        self._replaced = 0
+        return changes
 
     def __repr__(self):
         return '<FeedbackQuadParams({0.params!r}>'.format(self)
 
 
+class FrozenParams:
+    """Immutable snapshot of one voice's 24 params.
+
+    with_ and evolve return a new snapshot, leaving this one as it was, so
+    one can be handed to other threads and read without locks.
+    """
+    __slots__ = ('_vals',)
+    size = FeedbackParams.size
+
+    def __init__(self, vals):
+        vals = tuple(map(float, vals))
+        if len(vals) != self.size:
+            raise ValueError('Expected {} params, got {}'.format(self.size, len(vals)))
+        object.__setattr__(self, '_vals', vals)
+
+    @classmethod
+    def default_params(cls, spec=None):
+        return FeedbackParams.default_params(spec=spec).freeze()
+
+    def with_(self, **changes):
+        """New snapshot with changes, eg. with_(koscR=3.0)."""
+        return self.evolve(changes)
+
+    def evolve(self, changes):
+        """New snapshot with a {key: value} dict of changes applied."""
+        vals = list(self._vals)
+        for k,v in changes.items():
+            if k not in param_index:
+                raise LookupError('Key \'{}\' not found in params dict'.format(k))
+            vals[param_index[k]] = v
+        return FrozenParams(vals)
+
+    def randomize(self, randorams, spec=None):
+        """Randomize randorams. Returns a new snapshot."""
+        spec = _default_spec() if spec is None else spec
+        return self.evolve({k: spec.map_spec(k, random.random()) for k in randorams})
+
+    def thaw(self):
+        """Mutable FeedbackParams copy."""
+        return FeedbackParams.from_list(self._vals)
+
+    def serialize(self):
+        return self._vals
+
+    def to_vec(self):
+        return np.array(self._vals)
+
+    def to_json(self):
+        return self.thaw().to_json()
+
+    def keys(self):
+        return param_keys
+
+    def values(self):
+        return list(self._vals)
+
+    def __getitem__(self, key):
+        return self._vals[param_index[key]]
+
+    def __setattr__(self, name, val):
+        raise AttributeError('FrozenParams is immutable, use with_ or evolve')
+
+    def __eq__(self, other):
+        return isinstance(other, FrozenParams) and self._vals == other._vals
+
+    def __hash__(self):
+        return hash(self._vals)
+
+    def __reduce__(self):
+        return (FrozenParams, (self._vals,))
+
+    def __repr__(self):
+        return '<FrozenParams({!r})>'.format(list(zip(param_keys, self._vals)))
+
+
+class FrozenQuadParams:
+    """Immutable snapshot of four voices.
+
+    Derived snapshots share every voice that did not change, so with_ on one
+    param copies one voice and a 4-tuple of references.
+    """
+    __slots__ = ('params',)
+    size = FeedbackParams.size * 4
+
+    def __init__(self, voices):
+        object.__setattr__(self, 'params', tuple(voices))
+
+    @classmethod
+    def default_params(cls, spec=None):
+        voice = FrozenParams.default_params(spec=spec)
+        return cls((voice,) * 4)
+
+    def with_(self, index, **changes):
+        """New snapshot with changes to voice index, eg. with_(1, koscR=3.0)."""
+        return self.evolve({index: changes})
+
+    def evolve(self, changes):
+        """New snapshot from {voice: {key: value}}, or (voice, index, value) triples as from flush_changes."""
+        if not isinstance(changes, dict):
+            grouped = dict()
+            for voice, i, val in changes:
+                grouped.setdefault(voice, dict())[param_keys[i]] = val
+            changes = grouped
+        voices = list(self.params)
+        for voice, voice_changes in changes.items():
+            voices[voice] = voices[voice].evolve(voice_changes)
+        return FrozenQuadParams(voices)
+
+    def setall(self, param, val):
+        """New snapshot with param set for all four voices."""
+        return FrozenQuadParams(p.evolve({param: val}) for p in self.params)
+
+    def randomize(self, randorams, spec=None):
+        """Randomize randorams. Returns a new snapshot."""
+        spec = _default_spec() if spec is None else spec
+        return FrozenQuadParams(p.randomize(randorams, spec=spec) for p in self.params)
+
+    def diff(self, other):
+        """(voice, index, value) changes that turn other into self. Shared voices are skipped."""
+        changes = []
+        for voice, (p, q) in enumerate(zip(self.params, other.params)):
+            if p is not q:
+                changes.extend((voice, i, x) for i,(x, y) in enumerate(zip(p._vals, q._vals)) if x != y)
+        return changes
+
+    def thaw(self):
+        """Mutable FeedbackQuadParams copy."""
+        return FeedbackQuadParams([p.thaw() for p in self.params])
+
+    def serialize(self):
+        return list(itertools.chain.from_iterable(p._vals for p in self.params))
+
+    def to_vec(self):
+        return np.array(self.serialize())
+
+    def to_json(self):
+        return [p.to_json() for p in self.params]
+
+    def __getitem__(self, index):
+        return self.params[index]
+
+    def __len__(self):
+        return len(self.params)
+
+    def __setattr__(self, name, val):
+        raise AttributeError('FrozenQuadParams is immutable, use with_ or evolve')
+
+    def __eq__(self, other):
+        return isinstance(other, FrozenQuadParams) and self.params == other.params
+
+    def __hash__(self):
+        return hash(self.params)
+
+    def __reduce__(self):
+        return (FrozenQuadParams, (self.params,))
+
+    def __repr__(self):
+        return '<FrozenQuadParams({0.params!r}>'.format(self)
+
+
+class ChangeCoalescer:
+    """Batch live param changes and send them at most once per window seconds.
+
+    Call poll() from the control loop. The first poll that sees a change
+    starts the window; the poll that closes it sends every change made in
+    between as one list of (voice, index, value). Repeated writes to the same
+    param within a window are sent once, with the latest value.
+    """
+
+    def __init__(self, quad, send, window=0.01, clock=time.monotonic):
+        self.quad = quad
+        self.send = send
+        self.window = window
+        self.clock = clock
+        self.opened = None
+
+    def poll(self, now=None):
+        """Send if the window is up. Returns the number of changes sent."""
+        if self.opened is None:
+            if not self.quad.has_changes():
+                return 0
+            self.opened = self.clock() if now is None else now
+        now = self.clock() if now is None else now
+        if now - self.opened < self.window:
+            return 0
+        return self.flush()
+
+    def flush(self):
+        """Send pending changes now."""
+        self.opened = None
+        changes = self.quad.flush_changes()
+        if changes:
+            self.send(changes)
+        return len(changes)
+
+
+def spawn_seeds(seed, n):
+    """Spawn n independent seeds, one per worker, for randomize_batch."""
+    return np.random.SeedSequence(seed).spawn(n)
+
+
 class RenderParams(OrderedDict):
     """Keep track of render params."""
 
@@ -376,19 +745,83 @@ def test_feedbackparams_json():
 
 def test_json():
     import json
-    alpha = Sample("FeedbackQuad", render.RenderParams(), FeedbackQuadParams.default_params())
-    beta = Sample("FeedbackQuad", render.RenderParams(), FeedbackQuadParams.default_params())
+    alpha = Sample("FeedbackQuad", RenderParams(), FeedbackQuadParams.default_params())
+    beta = Sample("FeedbackQuad", RenderParams(), FeedbackQuadParams.default_params())
     with open("data_file.json", "w") as write_file:
         json.dump(alpha.to_json(), write_file)
         write_file.write('\n\n')
         json.dump(beta.to_json(), write_file)
 
 def test_to_vec():
-    import spec
+    from . import spec
     alpha = FeedbackParams.default_params(spec=spec.rust_spec())
     print(alpha.to_vec(params=['koscR'], unmap=True, spec=spec.rust_spec()))
 
 
+def test_randomize_batch():
+    alpha = FeedbackQuadParams.default_params()
+    keys = ['koscR', 'lfoCSwitch', 'vactrolDecay']
+    batch = alpha.randomize_batch(1000, keys, seed=7)
+    print(batch.shape == (1000, 4, FeedbackParams.size))
+    print((batch == alpha.randomize_batch(1000, keys, seed=7)).all())
+    seeds = spawn_seeds(7, 2)
+    print(not (alpha.randomize_batch(10, keys, seed=seeds[0]) == alpha.randomize_batch(10, keys, seed=seeds[1])).all())
+    print(FeedbackQuadParams.from_array(batch[0])[3]['koscR'] == batch[0, 3, param_index['koscR']])
+
+def test_changes():
+    alpha = FeedbackQuadParams.default_params()
+    sent = []
+    coalescer = ChangeCoalescer(alpha, sent.append, window=0.01)
+    alpha[1]['koscR'] = 3.0
+    alpha[1]['koscR'] = 4.0
+    alpha.setall('outZ', 0.5)
+    print(coalescer.poll(now=0.0) == 0 and coalescer.poll(now=0.005) == 0)
+    print(coalescer.poll(now=0.01) == 5)
+    print(sent[0][:2] == [(0, param_index['outZ'], 0.5), (1, param_index['koscR'], 4.0)])
+    print(not alpha.has_changes() and coalescer.poll(now=1.0) == 0)
+    loaded = [FeedbackParams.from_dict({'koscR': 3.0}), FeedbackParams.from_json(alpha[0].to_json()),
+              FeedbackParams.from_list(alpha[0].values()), FeedbackParams.default_params(),
+              FeedbackQuadParams.from_array(alpha.to_vec().reshape(4, 24))]
+    print(not any(p.has_changes() for p in loaded))
+    try:
+        loaded[3].to_vec()[0] = 1.0
+        print(False)
+    except ValueError:
+        print(not loaded[3].has_changes())
+    voice = FeedbackParams.default_params()
+    alpha[2] = voice
+    print(not voice.has_changes() and alpha.has_changes() and len(alpha.deepcopy().flush_changes()) == 24)
+    print(sorted(set(v for v,i,x in alpha.flush_changes())) == [2] and not alpha.has_changes())
+
+def test_json_ints():
+    import json
+    alpha = FeedbackParams.default_params()
+    print('"lfo_cswitch":0,' in json.dumps(alpha.to_json(), separators=(',', ':')))
+    alpha['lfoCSwitch'] = 0.4
+    print(alpha.to_json()['lfo_cswitch'] == 0.4 and alpha.to_json()['kosc_r'] == 18.6)
+
+def test_frozen():
+    alpha = FeedbackQuadParams.default_params().freeze()
+    beta = alpha.with_(1, koscR=3.0)
+    print(alpha[1]['koscR'] == 18.6 and beta[1]['koscR'] == 3.0)
+    print(beta[0] is alpha[0] and beta[2] is alpha[2] and beta[1] is not alpha[1])
+    print(beta.diff(alpha) == [(1, param_index['koscR'], 3.0)] and alpha.evolve(beta.diff(alpha)) == beta)
+    try:
+        beta[1]._vals = ()
+        print(False)
+    except AttributeError:
+        print(True)
+    gamma = beta.thaw()
+    gamma.setall('outZ', 0.5)
+    print(gamma.freeze() == beta.setall('outZ', 0.5) and beta[3]['outZ'] == 1.0)
+    delta = gamma.deepcopy()
+    delta[0]['koscR'] = 1.0
+    print(gamma[0]['koscR'] == 18.6 and gamma.randomize(['koscR'])[0] is not gamma[0])
+
 if __name__ == "__main__":
     test_json()
     test_to_vec()
+    test_randomize_batch()
+    test_changes()
+    test_json_ints()
+    test_frozen()
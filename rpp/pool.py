@@ -0,0 +1,50 @@
+"""Process pools for the analyses that score many patches, eg. PatchSearch and SensitivityAnalysis.
+
+The scoring function runs in worker processes, so it must be picklable: a
+module-level function or an instance of a module-level class, not a lambda
+or a closure. workers=None uses every CPU and workers=0 runs it in this
+process, which is also the way to debug it.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+def resolve_workers(workers):
+    """Number of worker processes for workers, None meaning one per CPU."""
+    return workers if workers is not None else os.cpu_count() or 1
+
+def process_pool(workers):
+    """ProcessPoolExecutor with resolve_workers(workers) processes, or None for 0."""
+    return ProcessPoolExecutor(resolve_workers(workers)) if workers != 0 else None
+
+def pool_map(func, items, workers, pool=None):
+    """[func(x) for x in items] on pool, or on a pool of its own, in chunks of about a quarter per worker."""
+    items = list(items)
+    if workers == 0:
+        return list(map(func, items))
+    n = resolve_workers(workers)
+    chunksize = max(1, len(items) // (4 * n))
+    if pool is not None:
+        return list(pool.map(func, items, chunksize=chunksize))
+    with ProcessPoolExecutor(n) as pool:
+        return list(pool.map(func, items, chunksize=chunksize))
+
+def stack_keys(keys, dtype):
+    """Equal-length bytes keys as an (n, width) array of dtype. (0, 0) when there are none."""
+    dtype = np.dtype(dtype)
+    width = len(keys[0]) // dtype.itemsize if keys else 0
+    return np.frombuffer(b''.join(keys), dtype=dtype).reshape(len(keys), width)
+
+
+def _square(x):
+    return x * x
+
+def test_pool():
+    print(pool_map(_square, range(10), 0) == pool_map(_square, range(10), 2) == [x * x for x in range(10)])
+    print(stack_keys([], np.int32).shape == (0, 0) and stack_keys([np.arange(3.0).tobytes()], np.float64).tolist() == [[0, 1, 2]])
+    print(resolve_workers(None) >= 1 and process_pool(0) is None)
+
+if __name__ == "__main__":
+    test_pool()
@@ -0,0 +1,160 @@
+import math
+
+import numpy as np
+
+from .params import FeedbackParams, FeedbackQuadParams, param_index
+from .spec import rust_spec
+
+
+def primes(n):
+    """First n primes."""
+    found = []
+    candidate = 2
+    while len(found) < n:
+        if all(candidate % p for p in found if p * p <= candidate):
+            found.append(candidate)
+        candidate += 1
+    return found
+
+def halton(n, d, start=0):
+    """Rows start..start+n of the d-dim Halton sequence. Row 0 (all zeros) is skipped."""
+    idx = np.arange(start + 1, start + n + 1, dtype=np.int64)
+    out = np.empty((n, d))
+    for j, base in enumerate(primes(d)):
+        col = np.zeros(n)
+        i = idx.copy()
+        f = 1.0 / base
+        while i.any():
+            col += f * (i % base)
+            i //= base
+            f /= base
+        out[:, j] = col
+    return out
+
+def sobol(n, d, start=0, seed=None):
+    """Rows start..start+n of a d-dim Sobol sequence, scrambled when seeded. Needs scipy."""
+    try:
+        from scipy.stats import qmc
+    except ImportError:
+        raise ImportError('sobol needs scipy, use halton or latin_hypercube instead')
+    engine = qmc.Sobol(d, scramble=seed is not None, seed=seed)
+    if start:
+        engine.fast_forward(start)
+    return engine.random(n)
+
+def _mix(x, key):
+    """splitmix64 finalizer of x ^ key, uint64 arrays."""
+    x = x ^ key
+    x ^= x >> np.uint64(33)
+    x *= np.uint64(0xff51afd7ed558ccd)
+    x ^= x >> np.uint64(33)
+    x *= np.uint64(0xc4ceb9fe1a85ec53)
+    x ^= x >> np.uint64(33)
+    return x
+
+def _permute(idx, total, keys):
+    """Keyed pseudo-random permutation of range(total), evaluated at idx.
+
+    A Feistel network over the smallest even number of bits that holds total,
+    cycle-walked back into range, so any element is computed on its own.
+    """
+    bits = max(2, int(total - 1).bit_length())
+    half = np.uint64((bits + 1) // 2)
+    mask = np.uint64((1 << int(half)) - 1)
+    x = np.asarray(idx, dtype=np.uint64).copy()
+    todo = np.ones(len(x), dtype=bool)
+    while todo.any():
+        v = x[todo]
+        left, right = v >> half, v & mask
+        for key in keys:
+            left, right = right, left ^ (_mix(right, key) & mask)
+        x[todo] = (left << half) | right
+        todo = x >= np.uint64(total)
+    return x.astype(np.int64)
+
+def latin_hypercube(n, d, start=0, total=None, seed=None):
+    """Rows start..start+n of a total-row Latin hypercube.
+
+    Each dim's strata are an independent keyed permutation of range(total)
+    and the jitter comes from a counter-based generator, so any chunk can be
+    made on its own and chunks agree with the full design.
+    """
+    total = n if total is None else total
+    rng = np.random.default_rng(seed)
+    keys = rng.integers(2**63, size=(d, 4), dtype=np.uint64)
+    rows = np.arange(start, start + n, dtype=np.int64)
+    strata = np.empty((n, d), dtype=np.int64)
+    for j in range(d):
+        strata[:, j] = _permute(rows, total, keys[j])
+    width = -(-d // 4)
+    bitgen = np.random.Philox(key=int(rng.integers(2**63)))
+    bitgen.advance(start * width)
+    jitter = np.random.Generator(bitgen).random((n, width * 4))[:, :d]
+    return (strata + jitter) / total
+
+methods = {
+    'sobol': lambda n, d, start, total, seed: sobol(n, d, start, seed),
+    'halton': lambda n, d, start, total, seed: halton(n, d, start),
+    'lhs': latin_hypercube,
+}
+
+
+class ParamSampler:
+    """Quasi-random designs over the normal space of some params, mapped thru the spec.
+
+    params are the keys to vary. Those in shared take one value for all four
+    voices; the rest vary per voice. Everything else is held at base, with
+    fixed (eg. {'lfoGate': 1.0}) applied to all voices on top.
+    """
+
+    def __init__(self, params, spec=None, base=None, fixed=None, shared=(), method='lhs', seed=None):
+        self.spec = rust_spec() if spec is None else spec
+        base = FeedbackQuadParams.default_params(spec=self.spec) if base is None else base.deepcopy()
+        for k,v in (fixed or {}).items():
+            base.setall(k, v)
+        self.base = base.to_vec().reshape(len(base.params), FeedbackParams.size)
+        self.shared = [k for k in params if k in shared]
+        self.per_voice = [k for k in params if k not in shared]
+        self.voices = len(base.params)
+        self.dim = len(self.shared) + self.voices * len(self.per_voice)
+        self.method = methods[method]
+        self.seed = seed
+
+    def unit(self, n, start=0, total=None):
+        """Rows start..start+n of the design in the unit cube, (n, dim)."""
+        return self.method(n, self.dim, start, n if total is None else total, self.seed)
+
+    def sample(self, n, start=0, total=None):
+        """Rows start..start+n of the design as an (n, 4, 24) param array."""
+        u = self.unit(n, start, total)
+        out = np.tile(self.base, (n, 1, 1))
+        ns = len(self.shared)
+        if ns:
+            out[:, :, [param_index[k] for k in self.shared]] = self.spec.map_batch(self.shared, u[:, :ns])[:, None, :]
+        if self.per_voice:
+            per_voice = u[:, ns:].reshape(n, self.voices, len(self.per_voice))
+            out[:, :, [param_index[k] for k in self.per_voice]] = self.spec.map_batch(self.per_voice, per_voice)
+        return out
+
+    def chunks(self, total, chunk_size=65536):
+        """Yield the total-row design in (chunk, 4, 24) pieces. Never holds more than one chunk."""
+        for start in range(0, total, chunk_size):
+            yield self.sample(min(chunk_size, total - start), start, total)
+
+
+def test_sampling():
+    u = latin_hypercube(100, 5, seed=1)
+    print(all(len(set(np.floor(u[:, j] * 100).astype(int))) == 100 for j in range(5)))
+    print(np.allclose(np.vstack([latin_hypercube(min(30, 100 - s), 5, s, 100, seed=1) for s in range(0, 100, 30)]), u))
+    for n, d in [(1000, 96), (100, 20), (1024, 192)]:
+        corr = np.corrcoef(latin_hypercube(n, d, seed=2), rowvar=False)
+        print(np.abs(corr[np.triu_indices(d, 1)]).max() < 6.0 / math.sqrt(n))
+    print(np.allclose(halton(4, 2), [[0.5, 1/3], [0.25, 2/3], [0.75, 1/9], [0.125, 4/9]]))
+    sampler = ParamSampler(['koscR', 'lfoCSwitch', 'fbackX'], shared=['fbackX'], fixed={'lfoGate': 0.0}, method='halton')
+    batch = np.concatenate(list(sampler.chunks(1000, 300)))
+    print(batch.shape == (1000, 4, 24) and (batch[:, :, param_index['lfoGate']] == 0.0).all())
+    print((batch[:, :, param_index['fbackX']] == batch[:, :1, param_index['fbackX']]).all())
+    print(set(np.unique(batch[:, :, param_index['lfoCSwitch']])) == {0.0, 1.0})
+
+if __name__ == "__main__":
+    test_sampling()
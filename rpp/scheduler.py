@@ -0,0 +1,212 @@
+import asyncio
+import itertools
+from collections import Counter
+
+
+def cost(sample):
+    """Estimated cost of a render in seconds: duration plus wait."""
+    return float(sample.render_params['duration']) + float(sample.render_params['wait'])
+
+
+class Job:
+    """A queued render. Orders by priority, then longest cost first."""
+    __slots__ = ('key', 'sample', 'future', 'cancelled')
+
+    def __init__(self, sample, priority, seq, future):
+        self.key = (priority, -cost(sample), seq)
+        self.sample = sample
+        self.future = future
+        self.cancelled = False
+
+    @property
+    def render_id(self):
+        return self.sample.render_params['render_id']
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+
+class RenderScheduler:
+    """Priority queue of Sample renders feeding a pool of workers.
+
+    render is a coroutine function, eg. RenderClient.render. Lower priority runs
+    first. Within a priority the most expensive jobs (duration + wait) go first,
+    so short jobs fill in at the end instead of leaving workers idle behind one
+    long render. submit blocks once maxsize jobs are queued.
+    """
+
+    def __init__(self, render, workers=4, maxsize=1000, max_retries=2, retry_delay=0.0):
+        self.render = render
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.queue = asyncio.PriorityQueue(maxsize)
+        self.jobs = dict()
+        self.running = dict()
+        self.stats = Counter()
+        self._seq = itertools.count()
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.ensure_future(self._work()) for i in range(self.workers)]
+        return self
+
+    async def submit(self, sample, priority=0):
+        """Queue a render. Waits while the queue is full. Returns a future for the result."""
+        render_id = sample.render_params['render_id']
+        if render_id in self.jobs:
+            raise ValueError('Render {} already scheduled'.format(render_id))
+        job = Job(sample, priority, next(self._seq), asyncio.get_running_loop().create_future())
+        self.jobs[render_id] = job
+        try:
+            await self.queue.put(job)
+        except BaseException:
+            # cancelled while waiting for room, the job never made it into the queue
+            if self.jobs.get(render_id) is job:
+                del self.jobs[render_id]
+            raise
+        self.stats['submitted'] += 1
+        return job.future
+
+    def cancel(self, render_id):
+        """Cancel a queued or running render. Returns False if it is unknown or already done."""
+        job = self.jobs.pop(render_id, None)
+        if job is None:
+            return False
+        job.cancelled = True
+        job.future.cancel()
+        task = self.running.get(render_id)
+        if task is not None:
+            task.cancel()
+        self.stats['cancelled'] += 1
+        return True
+
+    async def _work(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                if not job.cancelled:
+                    await self._run(job)
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job):
+        render_id = job.render_id
+        for attempt in range(self.max_retries + 1):
+            task = asyncio.ensure_future(self.render(job.sample))
+            self.running[render_id] = task
+            try:
+                result = await task
+            except asyncio.CancelledError:
+                if not job.cancelled:
+                    raise
+                return
+            except Exception as e:
+                if attempt < self.max_retries and not job.cancelled:
+                    self.stats['retried'] += 1
+                    await asyncio.sleep(self.retry_delay)
+                    if job.cancelled:
+                        return
+                    continue
+                self.stats['failed'] += 1
+                self._finish(job, exception=e)
+                return
+            else:
+                self.stats['completed'] += 1
+                self._finish(job, result=result)
+                return
+            finally:
+                self.running.pop(render_id, None)
+
+    def _finish(self, job, result=None, exception=None):
+        self.jobs.pop(job.render_id, None)
+        if job.future.done():
+            return
+        if exception is not None:
+            job.future.set_exception(exception)
+        else:
+            job.future.set_result(result)
+
+    async def join(self):
+        """Wait until every queued job has run."""
+        await self.queue.join()
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+async def schedule_all(render, samples, workers=4, **kwargs):
+    """Render samples thru a RenderScheduler. Returns results in order, exceptions in place."""
+    async with RenderScheduler(render, workers=workers, **kwargs) as scheduler:
+        futures = [await scheduler.submit(s) for s in samples]
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+
+def test_scheduler():
+    from .params import Sample, RenderParams, FeedbackQuadParams
+    alpha = FeedbackQuadParams.default_params()
+    order = []
+    flaky = {'3': 1}
+
+    async def fake_render(sample):
+        render_id = sample.render_params['render_id']
+        if flaky.get(render_id):
+            flaky[render_id] -= 1
+            raise RuntimeError('flaky')
+        order.append(render_id)
+        await asyncio.sleep(sample.render_params['duration'] / 1000.0)
+        return render_id
+
+    async def main():
+        samples = [Sample('FeedbackQuad', RenderParams(render_id=str(i), duration=i), alpha) for i in range(8)]
+        async with RenderScheduler(fake_render, workers=1, maxsize=100) as scheduler:
+            futures = [await scheduler.submit(s) for s in samples]
+            print(scheduler.cancel('5'))
+            await scheduler.join()
+        print(order == ['7', '6', '4', '3', '2', '1', '0'])
+        print(futures[3].result() == '3' and scheduler.stats['retried'] == 1)
+        print(futures[5].cancelled())
+
+    asyncio.run(main())
+
+def test_cancel():
+    from .params import Sample, RenderParams, FeedbackQuadParams
+    alpha = FeedbackQuadParams.default_params()
+    calls = []
+
+    async def failing(sample):
+        calls.append(sample.render_params['render_id'])
+        raise RuntimeError('down')
+
+    async def main():
+        async with RenderScheduler(failing, workers=1, maxsize=1, max_retries=3, retry_delay=0.05) as scheduler:
+            future = await scheduler.submit(Sample('FeedbackQuad', RenderParams(render_id='a'), alpha))
+            await asyncio.sleep(0.01)
+            scheduler.cancel('a')
+            await asyncio.sleep(0.1)
+            print(calls == ['a'] and future.cancelled())
+            # fill the queue so the next submit waits, then give up on it
+            await scheduler.submit(Sample('FeedbackQuad', RenderParams(render_id='b'), alpha))
+            await scheduler.submit(Sample('FeedbackQuad', RenderParams(render_id='c'), alpha))
+            blocked = asyncio.ensure_future(scheduler.submit(Sample('FeedbackQuad', RenderParams(render_id='d'), alpha)))
+            await asyncio.sleep(0)
+            blocked.cancel()
+            await asyncio.gather(blocked, return_exceptions=True)
+            print('d' not in scheduler.jobs)
+            scheduler.cancel('b')
+            scheduler.cancel('c')
+
+    asyncio.run(main())
+
+if __name__ == "__main__":
+    test_scheduler()
+    test_cancel()
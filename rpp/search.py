@@ -0,0 +1,193 @@
+import json
+import os
+
+import numpy as np
+
+from .params import FeedbackParams, FeedbackQuadParams, param_index
+from .pool import pool_map, process_pool, stack_keys
+from .sampling import latin_hypercube
+from .spec import rust_spec
+
+
+class PatchSearch:
+    """Genetic search for the FeedbackQuadParams that maximize fitness(quad).
+
+    Genomes are (voices, len(params)) arrays in the spec's normal space; all
+    other params stay at base. Each generation keeps the elite best, breeds
+    the rest from tournament winners and mutates them. Crossover swaps whole
+    voices, so a voice's params stay together. Continuous genes mutate by a
+    gaussian step of sigma, binary genes flip.
+
+    fitness runs on a process pool of workers, see rpp.pool. Scores are memoized on the genome quantized to
+    steps levels per param, as in rpp.cache, so a patch is never scored twice.
+    """
+
+    def __init__(self, fitness, params, spec=None, base=None, population=64, elite=4, crossover=0.7,
+                 mutation=0.1, sigma=0.1, tournament=3, steps=1024, workers=None, seed=None):
+        self.fitness = fitness
+        self.params = list(params)
+        self.spec = rust_spec() if spec is None else spec
+        base = FeedbackQuadParams.default_params(spec=self.spec) if base is None else base
+        self.base = base.to_vec().reshape(len(base.params), FeedbackParams.size)
+        self.voices = len(base.params)
+        self.index = [param_index[k] for k in self.params]
+        self.binary = np.array([self.spec[k].curve == 'binary' for k in self.params])
+        self.levels = np.where(self.binary, 1, steps).astype(np.float64)
+        self.population_size = population
+        self.elite = elite
+        self.crossover = crossover
+        self.mutation = mutation
+        self.sigma = sigma
+        self.tournament = tournament
+        self.workers = workers
+        self.rng = np.random.default_rng(seed)
+        self.memo = dict()
+        self.evaluations = 0
+        self.generation = 0
+        self.history = []
+        init_seed = int(self.rng.integers(2**63))
+        unit = latin_hypercube(population, self.voices * len(self.params), seed=init_seed)
+        self.population = self._snap(unit.reshape(population, self.voices, len(self.params)))
+        self.scores = None
+
+    def _snap(self, genomes):
+        """Round binary genes to 0 or 1."""
+        genomes[..., self.binary] = np.rint(genomes[..., self.binary])
+        return genomes
+
+    def key(self, genome):
+        return np.rint(genome * self.levels).astype(np.int32).tobytes()
+
+    def to_array(self, genomes):
+        """Genomes to an (n, voices, 24) param array."""
+        out = np.tile(self.base, (len(genomes), 1, 1))
+        out[:, :, self.index] = self.spec.map_batch(self.params, genomes)
+        return out
+
+    def to_params(self, genome):
+        return FeedbackQuadParams.from_array(self.to_array(genome[None])[0])
+
+    def evaluate(self, genomes, pool=None):
+        """Scores for genomes. Only patches not yet in memo reach fitness."""
+        keys = [self.key(g) for g in genomes]
+        todo = dict()
+        for i, key in enumerate(keys):
+            if key not in self.memo and key not in todo:
+                todo[key] = i
+        if todo:
+            quads = [FeedbackQuadParams.from_array(a) for a in self.to_array(genomes[list(todo.values())])]
+            scores = pool_map(self.fitness, quads, self.workers if pool is not None else 0, pool)
+            for key, score in zip(todo, scores):
+                score = float(score)
+                self.memo[key] = score if np.isfinite(score) else -np.inf
+            self.evaluations += len(todo)
+        return np.array([self.memo[key] for key in keys])
+
+    def _select(self, n):
+        entrants = self.rng.integers(len(self.population), size=(n, self.tournament))
+        return entrants[np.arange(n), np.argmax(self.scores[entrants], axis=1)]
+
+    def breed(self, n):
+        """n children of tournament winners, crossed over by voice and mutated."""
+        a = self.population[self._select(n)]
+        b = self.population[self._select(n)]
+        swap = (self.rng.random((n, self.voices)) < 0.5) & (self.rng.random((n, 1)) < self.crossover)
+        children = np.where(swap[:, :, None], b, a)
+        mutate = self.rng.random(children.shape) < self.mutation
+        stepped = np.clip(children + self.rng.normal(0.0, self.sigma, children.shape), 0.0, 1.0)
+        children = np.where(mutate & ~self.binary, stepped, children)
+        children = np.where(mutate & self.binary, 1.0 - children, children)
+        return self._snap(children)
+
+    def step(self, pool=None):
+        """Advance one generation. Returns the best score so far."""
+        if self.scores is None:
+            self.scores = self.evaluate(self.population, pool)
+        order = np.argsort(-self.scores, kind='stable')
+        elite = self.population[order[:self.elite]]
+        children = self.breed(self.population_size - len(elite))
+        children_scores = self.evaluate(children, pool)
+        self.population = np.concatenate([elite, children])
+        self.scores = np.concatenate([self.scores[order[:self.elite]], children_scores])
+        self.generation += 1
+        finite = self.scores[np.isfinite(self.scores)]
+        self.history.append((self.generation, float(self.scores.max()), float(finite.mean()) if len(finite) else -np.inf,
+                             self.evaluations))
+        return float(self.scores.max())
+
+    def run(self, generations, checkpoint=None, callback=None):
+        """Run generations more generations, writing checkpoint after each. callback(search) may return True to stop."""
+        pool = process_pool(self.workers)
+        try:
+            for i in range(generations):
+                self.step(pool)
+                if checkpoint is not None:
+                    self.save(checkpoint)
+                if callback is not None and callback(self):
+                    break
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return self.best()
+
+    def best(self):
+        """(FeedbackQuadParams, score) of the best patch in the population."""
+        if self.scores is None:
+            self.scores = self.evaluate(self.population)
+        i = int(np.argmax(self.scores))
+        return self.to_params(self.population[i]), float(self.scores[i])
+
+    def save(self, filename):
+        """Checkpoint population, scores, memo and RNG state to an .npz file."""
+        keys = list(self.memo)
+        tmp = filename + '.tmp.npz'
+        np.savez(tmp, population=self.population, scores=np.array([]) if self.scores is None else self.scores,
+                 generation=self.generation, evaluations=self.evaluations, history=np.array(self.history).reshape(-1, 4),
+                 memo_keys=stack_keys(keys, np.int32),
+                 memo_scores=np.array([self.memo[k] for k in keys]), params=np.array(self.params),
+                 rng=json.dumps(self.rng.bit_generator.state))
+        os.replace(tmp, filename)
+
+    def resume(self, filename):
+        """Restore a checkpoint written by save into this search. Returns self."""
+        f = np.load(filename)
+        if list(f['params']) != self.params:
+            raise ValueError('Checkpoint {} searches different params'.format(filename))
+        self.population = f['population']
+        self.scores = f['scores'] if len(f['scores']) else None
+        self.generation = int(f['generation'])
+        self.evaluations = int(f['evaluations'])
+        self.history = [(int(g), best, mean, int(n)) for g, best, mean, n in f['history'].tolist()]
+        self.memo = dict(zip((k.tobytes() for k in f['memo_keys']), f['memo_scores'].tolist()))
+        self.rng.bit_generator.state = json.loads(str(f['rng']))
+        return self
+
+    def __repr__(self):
+        return '<PatchSearch(generation {}, {} evaluations)>'.format(self.generation, self.evaluations)
+
+
+def _test_fitness(quad):
+    vec = quad.to_vec().reshape(-1, FeedbackParams.size)
+    return -float(np.sum((vec[:, param_index['koscFreq']] - 0.3) ** 2)) + float(vec[:, param_index['lfoCSwitch']].sum())
+
+def test_search():
+    import tempfile
+    keys = ['koscFreq', 'lfoCSwitch', 'lowPassPot']
+    search = PatchSearch(_test_fitness, keys, population=32, workers=0, seed=3)
+    start = search.best()[1]
+    quad, score = search.run(40)
+    print(score > start and score > 3.99 and all(p['lfoCSwitch'] == 1 for p in quad.params))
+    print(search.evaluations < 32 * 41 and len(search.memo) == search.evaluations)
+    checkpoint = os.path.join(tempfile.mkdtemp(), 'search.npz')
+    a = PatchSearch(_test_fitness, keys, population=16, workers=2, seed=5)
+    a.run(3, checkpoint=checkpoint)
+    b = PatchSearch(_test_fitness, keys, population=16, workers=0).resume(checkpoint)
+    a.run(3)
+    b.run(3)
+    print((a.population == b.population).all() and a.evaluations == b.evaluations and b.generation == 6)
+    fresh = PatchSearch(_test_fitness, keys, population=16, workers=0, seed=5)
+    fresh.save(checkpoint)
+    print(PatchSearch(_test_fitness, keys, population=16, workers=0).resume(checkpoint).memo == dict())
+
+if __name__ == "__main__":
+    test_search()
@@ -0,0 +1,234 @@
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from .params import FeedbackParams, FeedbackQuadParams, param_index, param_keys
+from .pool import pool_map, stack_keys
+from .sampling import latin_hypercube
+from .spec import rust_spec
+
+
+voice_names = ('A', 'B', 'C', 'D')
+
+
+class ResponseCache:
+    """Responses keyed by the exact mapped param values. save/load keep it between analyses."""
+
+    def __init__(self):
+        self.data = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def save(self, filename):
+        keys = list(self.data)
+        np.savez(filename, keys=stack_keys(keys, np.float64),
+                 values=np.array([self.data[k] for k in keys]))
+
+    @classmethod
+    def load(cls, filename):
+        cache = cls()
+        if os.path.exists(filename):
+            f = np.load(filename)
+            cache.data = dict(zip((k.tobytes() for k in f['keys']), f['values'].tolist()))
+        return cache
+
+    def __len__(self):
+        return len(self.data)
+
+
+class SensitivityResult:
+    """Per voice and param statistics of one analysis, ranked by the rank statistic."""
+
+    def __init__(self, method, keys, stats, rank):
+        self.method = method
+        self.keys = list(keys)
+        self.stats = stats
+        self.rank = rank
+
+    def table(self, voice):
+        """[(key, {stat: value}), ...] for one voice, most influential first."""
+        order = np.argsort(-self.stats[self.rank][voice], kind='stable')
+        return [(self.keys[j], OrderedDict((name, float(s[voice, j])) for name, s in self.stats.items())) for j in order]
+
+    def inert(self, threshold=0.01):
+        """Keys whose rank statistic is below threshold times the largest, in every voice."""
+        rank = self.stats[self.rank]
+        peak = np.nanmax(rank)
+        return [k for j,k in enumerate(self.keys) if np.all(rank[:, j] < threshold * peak)]
+
+    def format(self):
+        names = list(self.stats)
+        lines = []
+        for v in range(len(self.stats[self.rank])):
+            lines.append('Voice {} ({}, ranked by {})'.format(voice_names[v] if v < 4 else v, self.method, self.rank))
+            lines.append('  {:<20}'.format('param') + ''.join('{:>12}'.format(n) for n in names))
+            for key, row in self.table(v):
+                lines.append('  {:<20}'.format(key) + ''.join('{:>12.4g}'.format(x) for x in row.values()))
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.format()
+
+    def __repr__(self):
+        return '<SensitivityResult({}, {} params)>'.format(self.method, len(self.keys))
+
+
+class SensitivityAnalysis:
+    """Which params move response(quad), a float such as a spectral descriptor of the render.
+
+    Patches are perturbed in the spec's normal space, per voice, with every
+    other param held at base. response runs on a process pool of workers,
+    see rpp.pool. Every response is kept
+    in cache, so repeating or extending an analysis only renders new patches.
+    """
+
+    def __init__(self, response, params=None, spec=None, base=None, workers=None, cache=None):
+        self.response = response
+        self.spec = rust_spec() if spec is None else spec
+        self.params = [k for k in (param_keys if params is None else params) if k in self.spec.keys()]
+        base = FeedbackQuadParams.default_params(spec=self.spec) if base is None else base
+        self.base = base.to_vec().reshape(len(base.params), FeedbackParams.size)
+        self.voices = len(base.params)
+        self.index = [param_index[k] for k in self.params]
+        self.binary = np.array([self.spec[k].curve == 'binary' for k in self.params])
+        self.workers = workers
+        self.cache = ResponseCache() if cache is None else cache
+
+    def normal(self, quad=None):
+        """Normal values of the analysed params, (voices, params)."""
+        vec = self.base if quad is None else quad.to_vec().reshape(self.voices, FeedbackParams.size)
+        return self.spec.unmap_batch(self.params, vec[:, self.index])
+
+    def to_array(self, norms, base=None):
+        """(n, voices, params) normal values to (n, voices, 24) patches around base."""
+        out = np.tile(self.base if base is None else base, (len(norms), 1, 1))
+        out[:, :, self.index] = self.spec.map_batch(self.params, norms)
+        return out
+
+    def evaluate(self, patches):
+        """Responses for (n, voices, 24) patches. Only uncached patches reach response."""
+        patches = np.ascontiguousarray(patches, dtype=np.float64)
+        keys = [p.tobytes() for p in patches]
+        todo = OrderedDict()
+        for i, key in enumerate(keys):
+            if key not in self.cache.data and key not in todo:
+                todo[key] = i
+        self.cache.hits += len(keys) - len(todo)
+        self.cache.misses += len(todo)
+        if todo:
+            quads = [FeedbackQuadParams.from_array(patches[i]) for i in todo.values()]
+            values = pool_map(self.response, quads, self.workers)
+            self.cache.data.update(zip(todo, map(float, values)))
+        return np.array([self.cache.data[k] for k in keys])
+
+    def gradients(self, bases=None, h=0.01):
+        """Central finite differences in normal space around each base. Binary params are skipped.
+
+        Stats per voice and param: mean gradient, mean absolute gradient and
+        its std over bases. Ranked by mean absolute gradient.
+        """
+        bases = [None] if bases is None else bases
+        cont = np.flatnonzero(~self.binary)
+        nc = len(cont)
+        arrays, steps = [], []
+        for b in bases:
+            arr = self.base if b is None else b.to_vec().reshape(self.voices, FeedbackParams.size)
+            x0 = self.spec.unmap_batch(self.params, arr[:, self.index])
+            # one row per (voice, param), plus and minus
+            pert = np.tile(x0, (2, self.voices, nc, 1, 1))
+            v, j = np.meshgrid(np.arange(self.voices), np.arange(nc), indexing='ij')
+            hi = np.minimum(x0[v, cont[j]] + h, 1.0)
+            lo = np.maximum(x0[v, cont[j]] - h, 0.0)
+            pert[0, v, j, v, cont[j]] = hi
+            pert[1, v, j, v, cont[j]] = lo
+            steps.append(hi - lo)
+            arrays.append(self.to_array(pert.reshape(-1, self.voices, len(self.params)), arr))
+        y = self.evaluate(np.concatenate(arrays)).reshape(len(bases), 2, self.voices, nc)
+        grad = (y[:, 0] - y[:, 1]) / np.stack(steps)
+        stats = OrderedDict([('mean', grad.mean(axis=0)), ('abs_mean', np.abs(grad).mean(axis=0)),
+                             ('abs_std', np.abs(grad).std(axis=0))])
+        return SensitivityResult('gradient', [self.params[j] for j in cont], stats, 'abs_mean')
+
+    def morris(self, trajectories=20, levels=4, seed=None):
+        """Morris elementary effects over the unit cube of every voice's params.
+
+        Each trajectory moves one (voice, param) at a time by levels / (2 *
+        (levels - 1)); binary params flip instead. Stats: mu, mu_star (mean
+        absolute effect, the ranking) and sigma.
+        """
+        rng = np.random.default_rng(seed)
+        r, d = trajectories, self.voices * len(self.params)
+        binary = np.tile(self.binary, self.voices)
+        delta = levels / (2.0 * (levels - 1))
+        start = rng.integers(levels, size=(r, d)) / (levels - 1.0)
+        start[:, binary] = rng.integers(2, size=(r, binary.sum()))
+        step = np.where(binary, 1.0 - 2.0 * start, np.where(start + delta <= 1.0, delta, -delta))
+        order = np.argsort(rng.random((r, d)), axis=1)
+        # point k of trajectory t has moved the first k factors of order[t]
+        moved = np.zeros((r, d + 1, d))
+        rows = np.arange(r)[:, None]
+        moved[rows, np.arange(1, d + 1)[None, :], order] = 1.0
+        points = start[:, None, :] + np.cumsum(moved, axis=1) * step[:, None, :]
+        y = self.evaluate(self.to_array(points.reshape(-1, self.voices, len(self.params)))).reshape(r, d + 1)
+        effects = np.empty((r, d))
+        effects[rows, order] = np.diff(y, axis=1) / step[rows, order]
+        shape = (self.voices, len(self.params))
+        stats = OrderedDict([('mu', effects.mean(axis=0).reshape(shape)),
+                             ('mu_star', np.abs(effects).mean(axis=0).reshape(shape)),
+                             ('sigma', effects.std(axis=0, ddof=1 if r > 1 else 0).reshape(shape))])
+        return SensitivityResult('morris', self.params, stats, 'mu_star')
+
+    def sobol(self, n=1024, seed=None):
+        """Sobol first order (S1) and total (ST) indices, Saltelli/Jansen estimators, n * (d + 2) responses.
+
+        Ranked by ST. Binary params are rounded to 0 or 1.
+        """
+        d = self.voices * len(self.params)
+        binary = np.tile(self.binary, self.voices)
+        u = latin_hypercube(n, 2 * d, seed=seed)
+        u[:, np.concatenate([binary, binary])] = np.rint(u[:, np.concatenate([binary, binary])])
+        a, b = u[:, :d], u[:, d:]
+        ab = np.repeat(a[None], d, axis=0)
+        ab[np.arange(d), :, np.arange(d)] = b.T
+        points = np.concatenate([a, b, ab.reshape(-1, d)])
+        y = self.evaluate(self.to_array(points.reshape(-1, self.voices, len(self.params))))
+        ya, yb, yab = y[:n], y[n:2 * n], y[2 * n:].reshape(d, n)
+        var = np.var(np.concatenate([ya, yb]))
+        var = var if var > 0 else np.inf
+        shape = (self.voices, len(self.params))
+        stats = OrderedDict([('S1', (np.mean(yb * (yab - ya), axis=1) / var).reshape(shape)),
+                             ('ST', (0.5 * np.mean((ya - yab) ** 2, axis=1) / var).reshape(shape))])
+        return SensitivityResult('sobol', self.params, stats, 'ST')
+
+
+def _test_response(quad):
+    vec = quad.to_vec().reshape(-1, FeedbackParams.size)
+    return float(3.0 * vec[0, param_index['koscFreq']] + vec[:, param_index['lowPassPot']].sum() +
+                 0.5 * vec[1, param_index['lfoCSwitch']])
+
+def test_sensitivity():
+    import tempfile
+    keys = ['koscFreq', 'lowPassPot', 'lfoCSwitch', 'lfoIPhase']
+    sa = SensitivityAnalysis(_test_response, keys, workers=0)
+    grad = sa.gradients()
+    print(abs(grad.table(0)[0][1]['mean'] - 3.0) < 1e-9 and 'lfoCSwitch' not in grad.keys)
+    morris = sa.morris(trajectories=10, seed=1)
+    print(morris.table(0)[0][0] == 'koscFreq' and morris.table(1)[0][0] == 'lowPassPot')
+    print(abs(morris.stats['mu_star'][1, 2] - 0.5) < 1e-9 and morris.inert() == ['lfoIPhase'])
+    sobol = SensitivityAnalysis(_test_response, keys, workers=2).sobol(n=256, seed=2)
+    print(sobol.table(0)[0][0] == 'koscFreq' and sobol.stats['ST'][0, 3] < 1e-9)
+    filename = os.path.join(tempfile.mkdtemp(), 'responses.npz')
+    ResponseCache().save(filename)
+    print(len(ResponseCache.load(filename)) == 0)
+    sa.cache.save(filename)
+    again = SensitivityAnalysis(_test_response, keys, workers=0, cache=ResponseCache.load(filename))
+    again.morris(trajectories=10, seed=1)
+    print(again.cache.misses == 0 and again.cache.hits > 0)
+    print(len(str(morris).splitlines()) == 4 * 6)
+
+if __name__ == "__main__":
+    test_sensitivity()
@@ -1,43 +1,277 @@
 import math
-from collections import namedtuple
+import functools
+from collections import namedtuple, OrderedDict
+
+import numpy as np
 
 
 SpecElem = namedtuple('SpecElem', ['lo', 'hi', 'curve', 'default'])
 
+# A Warp is one param's curve compiled against its lo and hi. map and unmap
+# are plain scalar functions with the constants precomputed and the clipping
+# built in. map_batch and unmap_batch take an already clipped float64 array.
+# Where a curve needs exp or log, map and unmap call the same NumPy ufunc as
+# the batch functions, so both paths give bit-identical results.
+Warp = namedtuple('Warp', ['map', 'unmap', 'map_batch', 'unmap_batch'])
+
+curves = dict()
+
+def register_curve(name):
+    """Register factory(lo, hi) -> Warp under a curve name."""
+    def register(factory):
+        curves[name] = factory
+        return factory
+    return register
+
+def get_curve(curve):
+    """Warp factory for a curve name, or for a number (SC-style curve warp)."""
+    if isinstance(curve, (int, float)) and not isinstance(curve, bool):
+        return functools.partial(numeric_curve, float(curve))
+    if curve not in curves:
+        raise ValueError('Unknown curve \'{}\''.format(curve))
+    return curves[curve]
+
+@register_curve('linear')
+def linear_curve(lo, hi):
+    clo, chi = min(lo, hi), max(lo, hi)
+    lo, hi = float(lo), float(hi)
+    rng = hi - lo
+    def map_fn(val):
+        val = 0.0 if val < 0.0 else 1.0 if val > 1.0 else val
+        return float(val) * rng + lo
+    def unmap_fn(val):
+        val = clo if val < clo else chi if val > chi else val
+        return (float(val) - lo) / rng
+    return Warp(map_fn, unmap_fn, lambda col: col * rng + lo, lambda col: (col - lo) / rng)
+
+@register_curve('exp')
+def exp_curve(lo, hi):
+    clo, chi = min(lo, hi), max(lo, hi)
+    lo, hi = float(lo), float(hi)
+    ratio = hi / lo
+    log_ratio = float(np.log(ratio))
+    def map_fn(val):
+        val = 0.0 if val < 0.0 else 1.0 if val > 1.0 else val
+        return float(np.power(ratio, float(val))) * lo
+    def unmap_fn(val):
+        val = clo if val < clo else chi if val > chi else val
+        return float(np.log(float(val) / lo)) / log_ratio
+    return Warp(map_fn, unmap_fn,
+                lambda col: np.power(ratio, col) * lo,
+                lambda col: np.log(col / lo) / log_ratio)
+
+@register_curve('binary')
+def binary_curve(lo, hi):
+    clo, chi = min(lo, hi), max(lo, hi)
+    def map_fn(val):
+        return 0 if val <= 0.5 else 1
+    def unmap_fn(val):
+        return float(clo if val < clo else chi if val > chi else val)
+    return Warp(map_fn, unmap_fn, lambda col: np.where(col <= 0.5, 0.0, 1.0), lambda col: col)
+
+def numeric_curve(curve, lo, hi):
+    """SC CurveWarp. Negative curve bends up fast, positive bends up slow."""
+    if abs(curve) < 0.001:
+        return linear_curve(lo, hi)
+    clo, chi = min(lo, hi), max(lo, hi)
+    lo, hi = float(lo), float(hi)
+    grow = math.exp(curve)
+    a = (hi - lo) / (1.0 - grow)
+    b = lo + a
+    def map_fn(val):
+        val = 0.0 if val < 0.0 else 1.0 if val > 1.0 else val
+        return b - a * pow(grow, val)
+    def unmap_fn(val):
+        val = clo if val < clo else chi if val > chi else val
+        return math.log((b - val) / a) / curve
+    return Warp(map_fn, unmap_fn,
+                lambda col: b - a * np.power(grow, col),
+                lambda col: np.log((b - col) / a) / curve)
+
+@register_curve('cos')
+def cos_curve(lo, hi):
+    """SC CosineWarp."""
+    clo, chi = min(lo, hi), max(lo, hi)
+    lo, hi = float(lo), float(hi)
+    rng = hi - lo
+    def map_fn(val):
+        val = 0.0 if val < 0.0 else 1.0 if val > 1.0 else val
+        return (0.5 - math.cos(math.pi * val) * 0.5) * rng + lo
+    def unmap_fn(val):
+        val = clo if val < clo else chi if val > chi else val
+        return math.acos(1.0 - 2.0 * ((val - lo) / rng)) / math.pi
+    return Warp(map_fn, unmap_fn,
+                lambda col: (0.5 - np.cos(math.pi * col) * 0.5) * rng + lo,
+                lambda col: np.arccos(np.clip(1.0 - 2.0 * ((col - lo) / rng), -1.0, 1.0)) / math.pi)
+
+@register_curve('sin')
+def sin_curve(lo, hi):
+    """SC SineWarp."""
+    clo, chi = min(lo, hi), max(lo, hi)
+    lo, hi = float(lo), float(hi)
+    rng = hi - lo
+    half_pi = 0.5 * math.pi
+    def map_fn(val):
+        val = 0.0 if val < 0.0 else 1.0 if val > 1.0 else val
+        return math.sin(half_pi * val) * rng + lo
+    def unmap_fn(val):
+        val = clo if val < clo else chi if val > chi else val
+        return math.asin((val - lo) / rng) / half_pi
+    return Warp(map_fn, unmap_fn,
+                lambda col: np.sin(half_pi * col) * rng + lo,
+                lambda col: np.arcsin(np.clip((col - lo) / rng, -1.0, 1.0)) / half_pi)
+
+@register_curve('amp')
+def amp_curve(lo, hi):
+    """SC FaderWarp. Square law, for amplitudes."""
+    clo, chi = min(lo, hi), max(lo, hi)
+    lo, hi = float(lo), float(hi)
+    rng = hi - lo
+    if rng >= 0:
+        def map_fn(val):
+            val = 0.0 if val < 0.0 else 1.0 if val > 1.0 else val
+            return val * val * rng + lo
+        def unmap_fn(val):
+            val = clo if val < clo else chi if val > chi else val
+            return math.sqrt((val - lo) / rng)
+        return Warp(map_fn, unmap_fn,
+                    lambda col: col * col * rng + lo,
+                    lambda col: np.sqrt((col - lo) / rng))
+    def map_fn(val):
+        val = 0.0 if val < 0.0 else 1.0 if val > 1.0 else val
+        return (1.0 - (1.0 - val) ** 2) * rng + lo
+    def unmap_fn(val):
+        val = clo if val < clo else chi if val > chi else val
+        return 1.0 - math.sqrt(1.0 - (val - lo) / rng)
+    return Warp(map_fn, unmap_fn,
+                lambda col: (1.0 - (1.0 - col) ** 2) * rng + lo,
+                lambda col: 1.0 - np.sqrt(1.0 - (col - lo) / rng))
+
+def ampdb(amp):
+    return 20.0 * math.log10(amp) if amp > 0.0 else -math.inf
+
+def dbamp(db):
+    return 10.0 ** (db / 20.0)
+
+@register_curve('db')
+def db_curve(lo, hi):
+    """SC DbFaderWarp. lo and hi in dB, square law on amplitude."""
+    clo, chi = min(lo, hi), max(lo, hi)
+    lo_amp = dbamp(float(lo))
+    rng = dbamp(float(hi)) - lo_amp
+    def np_ampdb(amp):
+        with np.errstate(divide='ignore'):
+            return 20.0 * np.log10(amp)
+    if rng >= 0:
+        def map_fn(val):
+            val = 0.0 if val < 0.0 else 1.0 if val > 1.0 else val
+            return ampdb(val * val * rng + lo_amp)
+        def unmap_fn(val):
+            val = clo if val < clo else chi if val > chi else val
+            return math.sqrt((dbamp(val) - lo_amp) / rng)
+        return Warp(map_fn, unmap_fn,
+                    lambda col: np_ampdb(col * col * rng + lo_amp),
+                    lambda col: np.sqrt((10.0 ** (col / 20.0) - lo_amp) / rng))
+    def map_fn(val):
+        val = 0.0 if val < 0.0 else 1.0 if val > 1.0 else val
+        return ampdb((1.0 - (1.0 - val) ** 2) * rng + lo_amp)
+    def unmap_fn(val):
+        val = clo if val < clo else chi if val > chi else val
+        return 1.0 - math.sqrt(1.0 - (dbamp(val) - lo_amp) / rng)
+    return Warp(map_fn, unmap_fn,
+                lambda col: np_ampdb((1.0 - (1.0 - col) ** 2) * rng + lo_amp),
+                lambda col: 1.0 - np.sqrt(1.0 - (10.0 ** (col / 20.0) - lo_amp) / rng))
+
+def compile_elem(elem):
+    """Compile one SpecElem to a Warp.
+
+    A degenerate range (eg. lo == hi, or lo == 0 for exp) can't precompute its
+    constants. Those raise when called, like the uncompiled math would.
+    """
+    try:
+        return get_curve(elem.curve)(elem.lo, elem.hi)
+    except (ArithmeticError, ValueError) as e:
+        def fail(val, e=e):
+            raise type(e)(*e.args)
+        return Warp(fail, fail, fail, fail)
+
+# Rows per block in map_batch and unmap_batch. A block of every column stays
+# in cache, where whole strided columns of a large array would not.
+batch_rows = 4096
+
+def _batch(funcs, vals, bounds):
+    """Clip column j of vals to bounds[j] and apply funcs[j], batch_rows rows at a time."""
+    vals = np.asarray(vals, dtype=np.float64)
+    if not vals.size:
+        return np.empty(vals.shape, dtype=np.float64)
+    flat = vals.reshape(-1, vals.shape[-1])
+    out = np.empty(flat.shape, dtype=np.float64)
+    lo, hi = np.array(bounds, dtype=np.float64).reshape(-1, 2).T
+    for start in range(0, len(flat), batch_rows):
+        block = np.clip(flat[start:start + batch_rows], lo, hi)
+        dest = out[start:start + batch_rows]
+        for j, func in enumerate(funcs):
+            dest[:, j] = func(block[:, j])
+    return out.reshape(vals.shape)
+
+# Compiled Warps shared by specs with equal data, least recently used first.
+_compiled_specs = OrderedDict()
+compiled_specs_size = 32
+
 class ControlSpec:
     """A very basic SC-style control spec."""
 
     def __init__(self):
         self.data = dict()
+        self._compiled = None
 
     def add(self, param, spec, default=None):
         """Store in dict."""
+        get_curve(spec[2])
         self.data[param] = SpecElem(spec[0], spec[1], spec[2], default)
+        self._compiled = None
         # self.data[param] = spec
 
+    def compile(self):
+        """Dict of param -> Warp. Cached until the next add, and shared by specs with equal data."""
+        if self._compiled is None:
+            key = tuple(self.data.items())
+            compiled = _compiled_specs.get(key)
+            if compiled is None:
+                compiled = _compiled_specs[key] = {k: compile_elem(elem) for k,elem in self.data.items()}
+                while len(_compiled_specs) > compiled_specs_size:
+                    _compiled_specs.popitem(last=False)
+            else:
+                _compiled_specs.move_to_end(key)
+            self._compiled = compiled
+        return self._compiled
+
+    def mapper(self, param):
+        """Scalar map function for param. For the realtime control path."""
+        return self.compile()[param].map
+
+    def unmapper(self, param):
+        """Scalar unmap function for param."""
+        return self.compile()[param].unmap
+
     def map_spec(self, param, val):
         """Map from normal."""
-        lo, hi, curve, default = self.data[param]
-        val = self.clip(val, 0.0, 1.0)
-        if curve is 'linear':
-            return self.linear_map(float(val), float(lo), float(hi))
-        if curve is 'exp':
-            return self.exp_map(float(val), float(lo), float(hi))
-        if curve is 'binary':
-            return self.binary_map(val)
+        return (self._compiled or self.compile())[param].map(val)
 
     def unmap_spec(self, param, val):
         """Unmap to normal."""
-        lo, hi, curve, default = self.data[param]
-        clip_lo = min(lo, hi)
-        clip_hi = max(lo, hi)
-        val = self.clip(val, clip_lo, clip_hi)
-        if curve is 'linear':
-            return self.linear_unmap(float(val), float(lo), float(hi))
-        if curve is 'exp':
-            return self.exp_unmap(float(val), float(lo), float(hi))
-        if curve is 'binary':
-            return self.binary_unmap(val)
+        return (self._compiled or self.compile())[param].unmap(val)
+
+    def map_batch(self, params, vals):
+        """Map an (N, P) array from normal. Column j is mapped thru params[j]."""
+        compiled = self.compile()
+        return _batch([compiled[p].map_batch for p in params], vals, [(0.0, 1.0)] * len(params))
+
+    def unmap_batch(self, params, vals):
+        """Unmap an (N, P) array to normal. Column j is unmapped thru params[j]."""
+        compiled = self.compile()
+        bounds = [(min(self.data[p].lo, self.data[p].hi), max(self.data[p].lo, self.data[p].hi)) for p in params]
+        return _batch([compiled[p].unmap_batch for p in params], vals, bounds)
 
     def linear_map(self, val, lo, hi):
         """Linear mapping."""
@@ -73,6 +307,9 @@ class ControlSpec:
     def __getitem__(self, key):
         return self.data[key]
 
+    def __getstate__(self):
+        return {'data': self.data, '_compiled': None}
+
 def default_spec():
     spec = ControlSpec()
     spec.add('koscFreq', [1, 1, 'linear'])
@@ -192,7 +429,37 @@ def test_binary():
     print(spec.unmap_spec('lfoCSwitch', 0) == 0.0)
     print(spec.unmap_spec('lfoCSwitch', 1) == 1.0)
 
+def test_batch():
+    spec = rust_spec()
+    keys = list(spec.keys())
+    vals = np.random.uniform(-0.1, 1.1, (1000, len(keys)))
+    mapped = spec.map_batch(keys, vals)
+    print(all(mapped[i, j] == spec.map_spec(k, vals[i, j])
+              for i in range(len(vals)) for j,k in enumerate(keys)))
+    unmapped = spec.unmap_batch(keys, mapped * 1.1)
+    print(all(unmapped[i, j] == spec.unmap_spec(k, mapped[i, j] * 1.1)
+              for i in range(len(vals)) for j,k in enumerate(keys)))
+    for i in range(compiled_specs_size + 1):
+        extra = ControlSpec()
+        extra.add('x', [0, i + 1, 'linear'])
+        extra.compile()
+    print(len(_compiled_specs) == compiled_specs_size)
+
+def test_curves():
+    for curve in [-4, 3, 'cos', 'sin', 'amp']:
+        spec = ControlSpec()
+        spec.add('x', [0.1, 10.0, curve])
+        vals = np.linspace(0.0, 1.0, 11)
+        mapped = spec.map_batch(['x'], vals[:, None])[:, 0]
+        print(np.allclose(mapped, [spec.map_spec('x', v) for v in vals]) and
+              np.allclose(spec.unmap_batch(['x'], mapped[:, None])[:, 0], vals))
+    spec = ControlSpec()
+    spec.add('x', [-60.0, 0.0, 'db'])
+    print(abs(spec.map_spec('x', 1.0)) < 1e-12 and abs(spec.unmap_spec('x', spec.map_spec('x', 0.5)) - 0.5) < 1e-12)
+
 if __name__ == "__main__":
     test_linear()
     test_exp()
     test_binary()
+    test_batch()
+    test_curves()
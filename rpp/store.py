@@ -0,0 +1,231 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from .params import FeedbackParams, FeedbackQuadParams, RenderParams, Sample, param_index
+
+
+# A store is a directory holding:
+#
+#   meta.json      row count and layout, rewritten on every flush
+#   params.f64     raw float64 rows of 4 voices x 24 params, memory-mapped
+#   duration.f64   raw float64, one per row
+#   wait.f64       raw float64, one per row
+#   <name>.str     string columns, utf-8 back to back: topology, render_id, folder, filename
+#   <name>.off     uint64 end offset of each row's string in <name>.str
+#   render_id.idx  (hash, row) sorted by hash, uint64 pairs. hash is the first 8
+#                  bytes of blake2b(render_id) little-endian
+#
+# Everything but render_id.idx is written chunk by chunk, so a crash loses at
+# most the rows since the last flush. A store without render_id.idx, one
+# that was never closed, still opens, and builds the index in memory in O(N).
+voices = ('A', 'B', 'C', 'D')
+float_columns = ('duration', 'wait')
+string_columns = ('topology', 'render_id', 'folder', 'filename')
+
+def id_hash(render_id):
+    return int.from_bytes(hashlib.blake2b(render_id.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def index_array(hashes):
+    """(hash, row) pairs sorted by hash."""
+    order = np.argsort(hashes, kind='stable')
+    return np.stack([hashes[order], order.astype(np.uint64)], axis=1).astype('<u8')
+
+
+class StringColumn:
+    """Memory-mapped variable-width string column. Indexing a row decodes just that row."""
+
+    def __init__(self, path, name, rows):
+        self.rows = rows
+        self.ends = np.memmap(os.path.join(path, name + '.off'), dtype='<u8', mode='r') if rows else np.zeros(0, 'u8')
+        size = int(self.ends[-1]) if rows else 0
+        self.data = np.memmap(os.path.join(path, name + '.str'), dtype=np.uint8, mode='r') if size else b''
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += self.rows
+        if not 0 <= row < self.rows:
+            raise IndexError('row out of range')
+        start = int(self.ends[row - 1]) if row else 0
+        return bytes(self.data[start:int(self.ends[row])]).decode('utf-8')
+
+    def tolist(self):
+        blob = bytes(self.data[:int(self.ends[-1])]) if self.rows else b''
+        starts = [0] + self.ends[:-1].tolist()
+        return [blob[a:b].decode('utf-8') for a,b in zip(starts, self.ends.tolist())]
+
+    def __len__(self):
+        return self.rows
+
+
+class ColumnStoreWriter:
+    """Append Samples to a columnar store. Rows are streamed to disk, strings every chunk rows."""
+
+    def __init__(self, path, chunk=4096):
+        self.path = path
+        self.chunk = chunk
+        os.makedirs(path, exist_ok=True)
+        self.files = {name: open(os.path.join(path, name + '.f64'), 'wb') for name in ('params',) + float_columns}
+        for name in string_columns:
+            self.files[name] = open(os.path.join(path, name + '.str'), 'wb')
+            self.files[name + '.off'] = open(os.path.join(path, name + '.off'), 'wb')
+        self.files['hash'] = open(os.path.join(path, 'render_id.hash'), 'wb')
+        self.strings = {name: [] for name in string_columns}
+        self.offsets = {name: 0 for name in string_columns}
+        self.rows = 0
+
+    def append(self, sample):
+        """Append one Sample. Returns its row."""
+        for p in sample.synth_params.params:
+            self.files['params'].write(p.serialize())
+        for name in float_columns:
+            self.files[name].write(np.float64(sample.render_params[name]).tobytes())
+        self.strings['topology'].append(sample.topology)
+        for name in string_columns[1:]:
+            self.strings[name].append(str(sample.render_params[name]))
+        self.rows += 1
+        if len(self.strings['topology']) >= self.chunk:
+            self.flush()
+        return self.rows - 1
+
+    def flush(self):
+        """Write out the buffered string rows."""
+        for name, col in self.strings.items():
+            encoded = [v.encode('utf-8') for v in col]
+            self.files[name].write(b''.join(encoded))
+            ends = self.offsets[name] + np.cumsum([len(b) for b in encoded], dtype=np.uint64)
+            self.files[name + '.off'].write(ends.astype('<u8').tobytes())
+            if len(ends):
+                self.offsets[name] = int(ends[-1])
+        self.files['hash'].write(np.array([id_hash(v) for v in self.strings['render_id']], dtype='<u8').tobytes())
+        for col in self.strings.values():
+            del col[:]
+        for f in self.files.values():
+            f.flush()
+        self._write_meta()
+
+    def _write_meta(self):
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump({'rows': self.rows, 'voices': len(voices), 'size': FeedbackParams.size}, f)
+
+    def extend(self, samples):
+        for sample in samples:
+            self.append(sample)
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+        hash_file = os.path.join(self.path, 'render_id.hash')
+        index_array(np.fromfile(hash_file, dtype='<u8')).tofile(os.path.join(self.path, 'render_id.idx'))
+        os.remove(hash_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ColumnStore:
+    """Read-only, memory-mapped view of a columnar store. Opening reads no rows."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.rows = meta['rows']
+        shape = (self.rows, meta['voices'], meta['size'])
+        self.params = self._memmap('params', shape)
+        self.columns = {name: self._memmap(name, (self.rows,)) for name in float_columns}
+        for name in string_columns:
+            self.columns[name] = StringColumn(path, name, self.rows)
+        idx = os.path.join(path, 'render_id.idx')
+        if self.rows and os.path.exists(idx):
+            self._index = np.memmap(idx, dtype='<u8', mode='r').reshape(-1, 2)
+        else:
+            self._index = index_array(np.array([id_hash(r) for r in self.columns['render_id'].tolist()], dtype='<u8'))
+
+    def _memmap(self, name, shape):
+        if self.rows == 0:
+            return np.empty(shape, dtype=np.float64)
+        return np.memmap(os.path.join(self.path, name + '.f64'), dtype=np.float64, mode='r', shape=shape)
+
+    @classmethod
+    def create(cls, path, samples):
+        """Write samples to a new store at path and open it."""
+        with ColumnStoreWriter(path) as w:
+            w.extend(samples)
+        return cls(path)
+
+    def column(self, key, voice=None):
+        """Zero-copy view of one param. Takes 'koscR' with voice 'C' (or 2), or the suffixed 'koscRC'.
+
+        With no voice given returns all four voices as an (N, 4) view.
+        """
+        if key not in param_index and key[-1] in voices:
+            key, voice = key[:-1], key[-1]
+        if voice is None:
+            return self.params[:, :, param_index[key]]
+        if voice in voices:
+            voice = voices.index(voice)
+        return self.params[:, voice, param_index[key]]
+
+    def row(self, render_id):
+        """First row for render_id, by binary search on the stored hash index."""
+        h = id_hash(render_id)
+        hashes = self._index[:, 0]
+        i = int(np.searchsorted(hashes, np.uint64(h)))
+        while i < len(hashes) and int(hashes[i]) == h:
+            row = int(self._index[i, 1])
+            if self.columns['render_id'][row] == render_id:
+                return row
+            i += 1
+        raise KeyError(render_id)
+
+    def sample(self, row):
+        """Materialize a Sample. For inspection, not bulk access."""
+        render_params = RenderParams(**{name: self.columns[name][row] for name in string_columns[1:]},
+                                     **{name: float(self.columns[name][row]) for name in float_columns})
+        synth_params = FeedbackQuadParams([FeedbackParams.from_list(v.tolist()) for v in self.params[row]])
+        return Sample(self.columns['topology'][row], render_params, synth_params)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __len__(self):
+        return self.rows
+
+    def __repr__(self):
+        return '<ColumnStore({0.path!r}, rows={0.rows})>'.format(self)
+
+
+def test_store():
+    import tempfile
+    alpha = FeedbackQuadParams.default_params()
+    samples = []
+    for i in range(10):
+        quad = alpha.deepcopy()
+        quad[2]['koscR'] = float(i)
+        samples.append(Sample('FeedbackQuad', RenderParams(render_id='r{}'.format(i), folder='~/é', duration=i), quad))
+    path = os.path.join(tempfile.mkdtemp(), 'store')
+    w = ColumnStoreWriter(path, chunk=4)
+    w.extend(samples[:5])
+    print(os.path.getsize(os.path.join(path, 'render_id.off')) == 4 * 8)
+    unclosed = ColumnStore(path)
+    print(len(unclosed) == 4 and unclosed.row('r3') == 3)
+    w.extend(samples[5:])
+    w.close()
+    store = ColumnStore(path)
+    print(len(store) == 10)
+    print((store.column('koscR', 'C') == np.arange(10)).all())
+    print((store.column('koscRC') == store.column('koscR', 2)).all())
+    print(store.row('r7') == 7 and store['duration'][7] == 7.0)
+    print(store.sample(3).synth_params.to_vec().tolist() == samples[3].synth_params.to_vec().tolist())
+    print(store.sample(9).render_params == samples[9].render_params and store['folder'].tolist() == ['~/é'] * 10)
+    print(all(store.row('r{}'.format(i)) == i for i in range(10)) and 'r10' not in store['render_id'].tolist())
+
+if __name__ == "__main__":
+    test_store()
@@ -0,0 +1,263 @@
+import asyncio
+import math
+import struct
+
+import numpy as np
+
+
+# Audio block frame, little-endian, sent by the renderer while it renders:
+#
+#   offset  size  field
+#   0       2     magic b'ra'
+#   2       1     channels
+#   3       1     sample width in bytes, 4 (float32)
+#   4       4     frames in this block
+#   8       4     block sequence number
+#   12      ...   frames x channels interleaved float32
+audio_header = struct.Struct('<2sBBII')
+audio_magic = b'ra'
+
+
+class RingBuffer:
+    """Preallocated multichannel ring buffer with zero-copy reads.
+
+    Storage is mirrored: every write lands twice, capacity frames apart, so
+    any window of up to capacity frames is one contiguous view. A write with
+    no room drops the oldest frames and counts an overrun; a read asking for
+    more than is available returns what there is and counts an underrun.
+
+    The frames of the last read stay reserved, so writes do not land under
+    its view, until the next read or release. A write that needs their room
+    takes them back; copy a view that must outlive a reader falling behind.
+    """
+
+    def __init__(self, capacity, channels=1, dtype=np.float32):
+        self.capacity = capacity
+        self.channels = channels
+        self.data = np.zeros((2 * capacity, channels), dtype=dtype)
+        self.head = 0
+        self.available = 0
+        self.held = 0
+        self.written = 0
+        self.overruns = 0
+        self.overrun_frames = 0
+        self.underruns = 0
+
+    def write(self, block):
+        """Append an (n, channels) or (n,) block."""
+        block = np.asarray(block).reshape(-1, self.channels)
+        n = len(block)
+        if n > self.capacity:
+            block = block[-self.capacity:]
+            dropped = n - self.capacity
+            n = self.capacity
+        else:
+            dropped = 0
+        if n > self.capacity - self.held - self.available:
+            self.held = 0
+        tail = (self.head + self.available) % self.capacity
+        first = min(n, self.capacity - tail)
+        for base in (0, self.capacity):
+            self.data[base + tail:base + tail + first] = block[:first]
+            self.data[base:base + n - first] = block[first:]
+        self.written += n + dropped
+        self.available += n
+        if self.available > self.capacity:
+            dropped += self.available - self.capacity
+            self.head = (self.head + self.available - self.capacity) % self.capacity
+            self.available = self.capacity
+        if dropped:
+            self.overruns += 1
+            self.overrun_frames += dropped
+
+    def peek(self, n=None):
+        """View of the oldest n frames (default all) without consuming them."""
+        n = self.available if n is None else n
+        if n > self.available:
+            self.underruns += 1
+            n = self.available
+        return self.data[self.head:self.head + n]
+
+    def read(self, n=None):
+        """View of the oldest n frames, consumed. Valid until the next read or release, see above."""
+        view = self.peek(n)
+        self.head = (self.head + len(view)) % self.capacity
+        self.available -= len(view)
+        self.held = len(view)
+        return view
+
+    def release(self):
+        """Done with the last read's view. Its frames are free for writes again."""
+        self.held = 0
+
+    def latest(self, n):
+        """View of the newest n frames, without consuming anything."""
+        n = min(n, self.available)
+        end = self.head + self.available
+        return self.data[end - n:end]
+
+    def __len__(self):
+        return self.available
+
+
+class BlockConsumer:
+    """Looks at each incoming block. consume returns a reason string to abort the render, or None."""
+
+    def consume(self, block):
+        return None
+
+
+class RunningRMS(BlockConsumer):
+    """Exponentially smoothed RMS over blocks."""
+
+    def __init__(self, smoothing=0.9):
+        self.smoothing = smoothing
+        self.mean_square = 0.0
+
+    def consume(self, block):
+        ms = float(np.mean(np.square(block, dtype=np.float64))) if len(block) else 0.0
+        self.mean_square = self.smoothing * self.mean_square + (1.0 - self.smoothing) * ms
+        return None
+
+    @property
+    def rms(self):
+        return math.sqrt(self.mean_square)
+
+
+class ClipDetector(BlockConsumer):
+    """Abort on runaway feedback: too many samples at or above threshold."""
+
+    def __init__(self, threshold=0.999, max_fraction=0.01, min_frames=4096):
+        self.threshold = threshold
+        self.max_fraction = max_fraction
+        self.min_frames = min_frames
+        self.clipped = 0
+        self.frames = 0
+
+    def consume(self, block):
+        self.clipped += int(np.count_nonzero(np.abs(block) >= self.threshold))
+        self.frames += block.size
+        if self.frames >= self.min_frames and self.clipped > self.max_fraction * self.frames:
+            return 'clipping: {:.1%} of samples'.format(self.clipped / self.frames)
+        return None
+
+
+class SilenceDetector(BlockConsumer):
+    """Abort once the signal has stayed below threshold_db for seconds."""
+
+    def __init__(self, sr, threshold_db=-60.0, seconds=2.0):
+        self.threshold = 10.0 ** (threshold_db / 20.0)
+        self.limit = int(seconds * sr)
+        self.quiet = 0
+
+    def consume(self, block):
+        if len(block) and np.max(np.abs(block)) < self.threshold:
+            self.quiet += len(block)
+        else:
+            self.quiet = 0
+        if self.quiet >= self.limit:
+            return 'silence for {} frames'.format(self.quiet)
+        return None
+
+
+class AudioReceiver:
+    """Feeds incoming blocks to a RingBuffer and a chain of BlockConsumers.
+
+    The first consumer to return a reason calls on_abort(reason) once, eg. to
+    cancel the render thru RenderScheduler.cancel.
+    """
+
+    def __init__(self, ring, consumers=(), on_abort=None):
+        self.ring = ring
+        self.consumers = list(consumers)
+        self.on_abort = on_abort
+        self.abort_reason = None
+        self.blocks = 0
+        self.dropped_blocks = 0
+        self.last_seq = None
+
+    def feed(self, block, seq=None):
+        """Take one (frames, channels) block. Returns the abort reason, if any."""
+        if seq is not None:
+            if self.last_seq is not None and seq != (self.last_seq + 1) & 0xffffffff:
+                self.dropped_blocks += (seq - self.last_seq - 1) & 0xffffffff
+            self.last_seq = seq
+        self.blocks += 1
+        self.ring.write(block)
+        if self.abort_reason is None:
+            for consumer in self.consumers:
+                reason = consumer.consume(block)
+                if reason is not None:
+                    self.abort_reason = reason
+                    if self.on_abort is not None:
+                        self.on_abort(reason)
+                    break
+        return self.abort_reason
+
+    async def receive(self, reader):
+        """Read audio block frames from an asyncio StreamReader until EOF or abort."""
+        try:
+            while self.abort_reason is None:
+                head = await reader.readexactly(audio_header.size)
+                magic, channels, width, frames, seq = audio_header.unpack(head)
+                if magic != audio_magic or width != 4:
+                    raise ValueError('Bad audio block header')
+                payload = await reader.readexactly(frames * channels * width)
+                self.feed(np.frombuffer(payload, dtype='<f4').reshape(frames, channels), seq)
+        except asyncio.IncompleteReadError:
+            pass
+        return self.abort_reason
+
+
+def encode_audio_block(block, seq):
+    """Frame an (frames, channels) block for AudioReceiver.receive."""
+    block = np.ascontiguousarray(block, dtype='<f4')
+    if block.ndim == 1:
+        block = block[:, None]
+    return audio_header.pack(audio_magic, block.shape[1], 4, block.shape[0], seq & 0xffffffff) + block.tobytes()
+
+
+def test_ring():
+    ring = RingBuffer(8, channels=2)
+    ring.write(np.arange(12).reshape(6, 2))
+    print(ring.read(4).tolist() == [[0, 1], [2, 3], [4, 5], [6, 7]])
+    ring.write(np.arange(12, 24).reshape(6, 2))
+    view = ring.read(8)
+    print(view.base is ring.data and view[:, 0].tolist() == [8, 10, 12, 14, 16, 18, 20, 22])
+    ring.write(np.zeros((10, 2)))
+    print(ring.overruns == 1 and ring.overrun_frames == 2 and len(ring) == 8)
+    ring.read(10)
+    print(ring.underruns == 1)
+    ring = RingBuffer(8)
+    ring.write(np.arange(6))
+    view = ring.read(6)
+    ring.write(np.arange(6, 8))
+    print(view[:, 0].tolist() == list(range(6)) and ring.overruns == 0)
+    ring.write(np.arange(8, 10))
+    print(ring.held == 0 and ring.overruns == 0 and ring.read()[:, 0].tolist() == [6, 7, 8, 9])
+    ring.release()
+    ring.write(np.arange(10, 18))
+    print(ring.overruns == 0 and ring.read()[:, 0].tolist() == list(range(10, 18)))
+
+def test_receiver():
+    aborted = []
+    sr = 1000
+    receiver = AudioReceiver(RingBuffer(4096), [RunningRMS(), ClipDetector(min_frames=100), SilenceDetector(sr, seconds=0.5)],
+                             on_abort=aborted.append)
+
+    async def main():
+        reader = asyncio.StreamReader()
+        for seq in range(5):
+            reader.feed_data(encode_audio_block(np.full(100, 0.5), seq))
+        reader.feed_data(encode_audio_block(np.ones(100), 6))
+        reader.feed_eof()
+        return await receiver.receive(reader)
+
+    print(asyncio.run(main()).startswith('clipping') and aborted == [receiver.abort_reason])
+    print(receiver.dropped_blocks == 1 and abs(receiver.consumers[0].rms - 0.5) < 0.3)
+    silent = AudioReceiver(RingBuffer(4096), [SilenceDetector(sr, seconds=0.5)])
+    print([silent.feed(np.zeros(100)) for i in range(5)][-1] is not None)
+
+if __name__ == "__main__":
+    test_ring()
+    test_receiver()
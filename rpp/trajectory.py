@@ -0,0 +1,149 @@
+import asyncio
+import inspect
+import math
+import time
+
+import numpy as np
+
+from .params import FeedbackParams, FeedbackQuadParams, param_keys
+from .spec import rust_spec
+
+
+eases = {
+    'linear': lambda t: t,
+    'ease_in': lambda t: t * t,
+    'ease_out': lambda t: 1.0 - (1.0 - t) ** 2,
+    'smooth': lambda t: t * t * (3.0 - 2.0 * t),
+    'cosine': lambda t: 0.5 - 0.5 * np.cos(math.pi * t),
+}
+
+
+class Trajectory:
+    """A path thru several FeedbackQuadParams, interpolated in the spec's normal space.
+
+    Interpolating unmapped values makes exp params such as koscR and
+    vactrolAttack sweep evenly by ear. Binary params are interpolated too and
+    mapped back thru the spec, so they switch once, halfway thru a segment.
+    times are keyframe positions in [0, 1], evenly spaced by default. ease is
+    a name from eases or a function on [0, 1] applied within each segment.
+
+    A param that is equal at every keyframe, or outside the spec range at any
+    (eg. the default vactrolDecay), is interpolated linearly on its own values
+    instead, so it is never clipped. At a keyframe every value is exactly the
+    keyframe's.
+    """
+
+    def __init__(self, points, times=None, ease='linear', spec=None):
+        if len(points) < 2:
+            raise ValueError('A trajectory needs at least two points')
+        self.spec = rust_spec() if spec is None else spec
+        arrays = [p.to_vec().reshape(-1, FeedbackParams.size) if isinstance(p, FeedbackQuadParams) else
+                  np.asarray(p, dtype=np.float64).reshape(-1, FeedbackParams.size) for p in points]
+        self.raw = np.stack(arrays)
+        self.norm = self.spec.unmap_batch(param_keys, self.raw)
+        lo = np.array([min(self.spec[k].lo, self.spec[k].hi) for k in param_keys])
+        hi = np.array([max(self.spec[k].lo, self.spec[k].hi) for k in param_keys])
+        with np.errstate(invalid='ignore'):
+            outside = ~((self.raw >= lo) & (self.raw <= hi))
+        self.linear = outside.any(axis=0) | (self.raw == self.raw[0]).all(axis=0)
+        self.times = np.linspace(0.0, 1.0, len(points)) if times is None else np.asarray(times, dtype=np.float64)
+        if len(self.times) != len(points) or np.any(np.diff(self.times) <= 0):
+            raise ValueError('times must increase and match the points')
+        self.ease = eases[ease] if isinstance(ease, str) else ease
+
+    def _segments(self, t):
+        """Segment index and eased weight within it for each position t."""
+        t = np.clip(np.asarray(t, dtype=np.float64), self.times[0], self.times[-1])
+        seg = np.clip(np.searchsorted(self.times, t, side='right') - 1, 0, len(self.times) - 2)
+        local = (t - self.times[seg]) / (self.times[seg + 1] - self.times[seg])
+        return seg, self.ease(local)[:, None, None]
+
+    def normal(self, t):
+        """Normal values at positions t, shape (len(t), voices, 24)."""
+        seg, w = self._segments(t)
+        return self.norm[seg] + (self.norm[seg + 1] - self.norm[seg]) * w
+
+    def values(self, t):
+        """Param values at positions t, shape (len(t), voices, 24)."""
+        seg, w = self._segments(t)
+        mapped = self.spec.map_batch(param_keys, self.norm[seg] + (self.norm[seg + 1] - self.norm[seg]) * w)
+        linear = self.raw[seg] + (self.raw[seg + 1] - self.raw[seg]) * w
+        out = np.where(self.linear, linear, mapped)
+        out[w[:, 0, 0] == 0.0] = self.raw[seg[w[:, 0, 0] == 0.0]]
+        out[w[:, 0, 0] == 1.0] = self.raw[seg[w[:, 0, 0] == 1.0] + 1]
+        return out
+
+    def matrix(self, steps):
+        """The whole control matrix, (steps, voices * 24), in one call."""
+        return self.values(np.linspace(self.times[0], self.times[-1], steps)).reshape(steps, -1)
+
+
+def jitter_stats(lateness):
+    """Summary of how late each step went out, in seconds."""
+    lateness = np.asarray(lateness)
+    if not len(lateness):
+        return {'steps': 0}
+    return {
+        'steps': len(lateness),
+        'mean': float(lateness.mean()),
+        'p50': float(np.percentile(lateness, 50)),
+        'p99': float(np.percentile(lateness, 99)),
+        'max': float(lateness.max()),
+    }
+
+def stream(matrix, send, rate=100.0, clock=time.perf_counter, sleep=time.sleep):
+    """Call send(row) for each row at rate rows per second. Returns jitter_stats.
+
+    Steps are scheduled against the start time, so lateness does not accumulate.
+    """
+    start = clock()
+    lateness = np.empty(len(matrix))
+    for i, row in enumerate(matrix):
+        target = start + i / rate
+        wait = target - clock()
+        if wait > 0:
+            sleep(wait)
+        lateness[i] = clock() - target
+        send(row)
+    return jitter_stats(lateness)
+
+async def astream(matrix, send, rate=100.0, clock=time.perf_counter):
+    """stream for asyncio. send may be a plain function or a coroutine function."""
+    start = clock()
+    lateness = np.empty(len(matrix))
+    is_coroutine = inspect.iscoroutinefunction(send)
+    for i, row in enumerate(matrix):
+        target = start + i / rate
+        wait = target - clock()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        lateness[i] = clock() - target
+        if is_coroutine:
+            await send(row)
+        else:
+            send(row)
+    return jitter_stats(lateness)
+
+
+def test_trajectory():
+    spec = rust_spec()
+    alpha = FeedbackQuadParams.default_params(spec=spec).setall('koscR', 0.1).setall('lfoCSwitch', 0)
+    beta = alpha.deepcopy().setall('koscR', 40.0).setall('lfoCSwitch', 1)
+    m = Trajectory([alpha, beta]).matrix(5)
+    print(m.shape == (5, 96))
+    print(np.allclose(m[:, 0], [spec.map_spec('koscR', t) for t in np.linspace(0, 1, 5)]))
+    print(m[:, 7].tolist() == [0.0, 0.0, 0.0, 1.0, 1.0])
+    m = Trajectory([alpha, beta, alpha], times=[0.0, 0.25, 1.0], ease='smooth').matrix(5)
+    print(abs(m[1, 0] - 40.0) < 1e-9 and abs(m[-1, 0] - 0.1) < 1e-9)
+    gamma = FeedbackQuadParams.default_params(spec=spec).randomize(['koscR', 'outZ'], spec=spec)
+    path = Trajectory([FeedbackQuadParams.default_params(spec=spec), gamma])
+    print((path.values([0.0])[0].ravel() == FeedbackQuadParams.default_params(spec=spec).to_vec()).all() and
+          (path.values([1.0])[0].ravel() == gamma.to_vec()).all())
+    decay = param_keys.index('vactrolDecay')
+    print((path.matrix(7).reshape(7, -1, 24)[:, :, decay] == 4.0).all())
+    rows = []
+    stats = stream(m, rows.append, rate=1000.0)
+    print(len(rows) == 5 and stats['steps'] == 5 and stats['max'] < 0.05)
+
+if __name__ == "__main__":
+    test_trajectory()
@@ -0,0 +1,154 @@
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from .params import FeedbackQuadParams
+
+
+# Frame layout, little-endian:
+#
+#   offset  size  field
+#   0       2     magic b'rp'
+#   2       1     version
+#   3       1     value width in bytes, 4 (float32) or 8 (float64)
+#   4       1     topology, index into topologies
+#   5       1     kind, 0 full or 1 delta
+#   6       2     parameter count
+#   8       4     sequence number
+#   12      ...   count values
+#
+# A full frame carries every value in order. A delta frame carries count
+# packed (uint8 voice, uint8 index, value) records, see encode_delta_into.
+header = struct.Struct('<2sBBBBHI')
+header_size = header.size
+magic = b'rp'
+version = 1
+
+topologies = ('Feedback', 'FeedbackQuad')
+
+dtypes = {4: np.dtype('<f4'), 8: np.dtype('<f8')}
+
+full, delta = 0, 1
+
+delta_dtypes = {width: np.dtype([('voice', 'u1'), ('index', 'u1'), ('value', dtype)])
+                for width, dtype in dtypes.items()}
+
+Frame = namedtuple('Frame', ['topology', 'seq', 'values'])
+
+def frame_size(count, width=4):
+    """Size in bytes of a frame holding count values."""
+    return header_size + count * width
+
+def encode_into(buf, values, topology, seq, offset=0, width=4):
+    """Write a frame into buf at offset. Returns the number of bytes written."""
+    values = np.asarray(values)
+    count = values.size
+    header.pack_into(buf, offset, magic, version, width, topologies.index(topology), full, count, seq & 0xffffffff)
+    out = np.frombuffer(buf, dtype=dtypes[width], count=count, offset=offset + header_size)
+    out[:] = values.ravel()
+    return frame_size(count, width)
+
+def encode_params_into(buf, params, topology, seq, offset=0, width=4):
+    """Write a FeedbackParams or FeedbackQuadParams into buf without an intermediate list."""
+    voices = params.params if isinstance(params, FeedbackQuadParams) else [params]
+    count = sum(p.size for p in voices)
+    header.pack_into(buf, offset, magic, version, width, topologies.index(topology), full, count, seq & 0xffffffff)
+    out = np.frombuffer(buf, dtype=dtypes[width], count=count, offset=offset + header_size)
+    pos = 0
+    for p in voices:
+        out[pos:pos + p.size] = p.to_vec()
+        pos += p.size
+    return frame_size(count, width)
+
+def delta_frame_size(count, width=4):
+    """Size in bytes of a delta frame holding count changes."""
+    return header_size + count * delta_dtypes[width].itemsize
+
+def encode_delta_into(buf, changes, topology, seq, offset=0, width=4):
+    """Write (voice, index, value) changes, eg. from flush_changes, as a delta frame."""
+    count = len(changes)
+    header.pack_into(buf, offset, magic, version, width, topologies.index(topology), delta, count, seq & 0xffffffff)
+    out = np.frombuffer(buf, dtype=delta_dtypes[width], count=count, offset=offset + header_size)
+    out[:] = changes
+    return delta_frame_size(count, width)
+
+def encode(values, topology, seq, width=4):
+    """Convenience. Returns a new bytearray holding one frame."""
+    buf = bytearray(frame_size(np.size(values), width))
+    encode_into(buf, values, topology, seq, width=width)
+    return buf
+
+def read_header(buf, offset=0):
+    """Read and check a frame header. Returns (topology, seq, count, width, kind)."""
+    mgc, ver, width, topo, kind, count, seq = header.unpack_from(buf, offset)
+    if mgc != magic:
+        raise ValueError('Bad frame magic {!r}'.format(mgc))
+    if ver != version:
+        raise ValueError('Unsupported frame version {}'.format(ver))
+    if width not in dtypes:
+        raise ValueError('Bad value width {}'.format(width))
+    if kind not in (full, delta):
+        raise ValueError('Bad frame kind {}'.format(kind))
+    if topo >= len(topologies):
+        raise ValueError('Bad topology {}'.format(topo))
+    return topologies[topo], seq, count, width, kind
+
+def decode_from(buf, offset=0):
+    """Read a frame from buf. The values are a zero-copy view into buf.
+
+    For a delta frame values is a structured array with fields voice, index and value.
+    """
+    topology, seq, count, width, kind = read_header(buf, offset)
+    dtype = dtypes[width] if kind == full else delta_dtypes[width]
+    values = np.frombuffer(buf, dtype=dtype, count=count, offset=offset + header_size)
+    return Frame(topology, seq, values)
+
+def decode_into(buf, out, offset=0):
+    """Read a full frame from buf, copying the values into out. Returns (topology, seq, nbytes)."""
+    topology, seq, values = decode_from(buf, offset)
+    if values.dtype.names is not None:
+        raise ValueError('decode_into takes a full frame, use apply_delta for deltas')
+    out[:values.size] = values
+    return topology, seq, frame_size(values.size, values.itemsize)
+
+def apply_delta(buf, out, offset=0):
+    """Apply a delta frame to out, a (voices, 24) array. Returns (topology, seq, nbytes)."""
+    topology, seq, values = decode_from(buf, offset)
+    out[values['voice'], values['index']] = values['value']
+    return topology, seq, header_size + values.nbytes
+
+
+def test_roundtrip():
+    alpha = FeedbackQuadParams.default_params()
+    buf = bytearray(2048)
+    n = encode_params_into(buf, alpha, 'FeedbackQuad', 7, width=8)
+    print(n == 12 + 96 * 8)
+    frame = decode_from(buf)
+    print(frame.topology == 'FeedbackQuad' and frame.seq == 7)
+    print((frame.values == alpha.to_vec()).all())
+    out = np.empty(96, dtype=np.float32)
+    encode_into(buf, alpha.serialize(), 'FeedbackQuad', 8, offset=n)
+    print(decode_into(buf, out, offset=n) == ('FeedbackQuad', 8, 12 + 96 * 4))
+    print(np.allclose(out, alpha.to_vec()))
+    buf[4] = len(topologies)
+    try:
+        read_header(buf)
+        print(False)
+    except ValueError:
+        print(True)
+
+def test_delta():
+    alpha = FeedbackQuadParams.default_params()
+    alpha[2]['koscR'] = 3.0
+    alpha.setall('lfoCSwitch', 1.0)
+    buf = bytearray(1024)
+    n = encode_delta_into(buf, alpha.flush_changes(), 'FeedbackQuad', 9, width=8)
+    print(n == 12 + 5 * 10)
+    state = FeedbackQuadParams.default_params().to_vec().reshape(4, 24)
+    print(apply_delta(buf, state) == ('FeedbackQuad', 9, n))
+    print((state.ravel() == alpha.to_vec()).all())
+
+if __name__ == "__main__":
+    test_roundtrip()
+    test_delta()